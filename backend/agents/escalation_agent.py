@@ -3,8 +3,10 @@ Escalation Agent - Handles automatic task escalation
 """
 import logging
 from datetime import datetime, timedelta
+from sqlalchemy import func, or_, and_
 from sqlalchemy.orm import Session
 from database import SessionLocal
+from audit_writer import bulk_write_audit
 import models
 
 logger = logging.getLogger(__name__)
@@ -20,12 +22,14 @@ class EscalationAgent:
     
     def __init__(self):
         self.agent_name = "EscalationAgent"
+        self._status_id = None  # AgentStatus primary key, resolved on first run
         self.escalation_threshold_hours = 0  # Hours past due before escalation
         self.confidence_escalation_threshold = 30.0  # Confidence below this triggers escalation
+        self.stale_progress_days = 3  # In-progress tasks untouched this long are escalated
     
-    def should_escalate(self, task: models.Task) -> tuple:
+    def should_escalate(self, task: models.Task, now: datetime) -> tuple:
         """
-        Determine if a task should be escalated
+        Determine if a task should be escalated as of `now`
         Returns: (should_escalate, reason)
         """
         if task.is_escalated:
@@ -35,10 +39,9 @@ class EscalationAgent:
             return False, None
         
         # Check if overdue
-        if task.due_date and task.due_date < datetime.utcnow():
-            hours_overdue = (datetime.utcnow() - task.due_date).total_seconds() / 3600
-            if hours_overdue > self.escalation_threshold_hours:
-                return True, f"Overdue by {hours_overdue:.1f} hours"
+        hours_overdue = (now - task.due_date).total_seconds() / 3600 if task.due_date else None
+        if hours_overdue is not None and hours_overdue > max(self.escalation_threshold_hours, 0):
+            return True, f"Overdue by {hours_overdue:.1f} hours"
         
         # Check confidence score
         if task.confidence_score < self.confidence_escalation_threshold:
@@ -46,14 +49,14 @@ class EscalationAgent:
         
         # Check if task has been in progress too long without updates
         if task.status == models.TaskStatus.IN_PROGRESS and task.updated_at:
-            days_since_update = (datetime.utcnow() - task.updated_at).days
-            if days_since_update >= 3:
+            days_since_update = (now - task.updated_at).days
+            if days_since_update >= self.stale_progress_days:
                 return True, f"No progress for {days_since_update} days"
         
         return False, None
     
-    def find_manager_to_escalate_to(self, task: models.Task, db: Session) -> models.User:
-        """Find an appropriate manager to escalate to"""
+    def find_manager_to_escalate_to(self, db: Session) -> models.User:
+        """Find an appropriate manager to escalate to (same for every task in a run)"""
         # First, try to find any manager
         manager = db.query(models.User).filter(
             models.User.role == models.UserRole.MANAGER,
@@ -69,8 +72,8 @@ class EscalationAgent:
         
         return manager
     
-    def escalate_task(self, task: models.Task, reason: str, manager: models.User, db: Session):
-        """Perform the escalation"""
+    def escalate_task(self, task: models.Task, reason: str, manager: models.User) -> tuple:
+        """Perform the escalation, returning (notifications, audit log row) to insert"""
         task.is_escalated = True
         task.escalated_to = manager.id
         task.status = models.TaskStatus.ESCALATED
@@ -83,7 +86,7 @@ class EscalationAgent:
             user_id=manager.id,
             task_id=task.id
         )
-        db.add(notification)
+        notifications = [notification]
         
         # Also notify the assignee
         if task.assigned_to != manager.id:
@@ -94,66 +97,92 @@ class EscalationAgent:
                 user_id=task.assigned_to,
                 task_id=task.id
             )
-            db.add(assignee_notification)
+            notifications.append(assignee_notification)
         
         # Log the escalation
-        audit_log = models.AuditLog(
-            action="task_escalated",
-            entity_type="task",
-            entity_id=task.id,
-            agent_involved=self.agent_name,
-            details=f"Task escalated to {manager.name}. Reason: {reason}"
-        )
-        db.add(audit_log)
+        audit_log = {
+            "action": "task_escalated",
+            "entity_type": "task",
+            "entity_id": task.id,
+            "agent_involved": self.agent_name,
+            "details": f"Task escalated to {manager.name}. Reason: {reason}"
+        }
+        
+        return notifications, audit_log
+    
+    def get_agent_status(self, db: Session) -> models.AgentStatus:
+        """Load this agent's status row, by primary key once it is known"""
+        if self._status_id is not None:
+            return db.get(models.AgentStatus, self._status_id)
+        
+        agent_status = db.query(models.AgentStatus).filter(
+            models.AgentStatus.agent_name == self.agent_name
+        ).first()
+        if agent_status:
+            self._status_id = agent_status.id
+        return agent_status
     
     def run(self):
         """Execute escalation agent job"""
         logger.info(f"[{self.agent_name}] Starting escalation check...")
         
+        now = datetime.utcnow()
         db = SessionLocal()
         try:
-            # Get active, non-escalated tasks
+            # Get active, non-escalated tasks that match an escalation rule.
+            # should_escalate() is still applied below to build the reason.
             tasks = db.query(models.Task).filter(
                 models.Task.is_escalated == False,
                 models.Task.status.in_([
                     models.TaskStatus.PENDING,
                     models.TaskStatus.IN_PROGRESS,
                     models.TaskStatus.OVERDUE
-                ])
+                ]),
+                or_(
+                    models.Task.due_date < now - timedelta(hours=self.escalation_threshold_hours),
+                    models.Task.confidence_score < self.confidence_escalation_threshold,
+                    and_(
+                        models.Task.status == models.TaskStatus.IN_PROGRESS,
+                        models.Task.updated_at <= now - timedelta(days=self.stale_progress_days)
+                    )
+                )
             ).all()
             
             escalated_count = 0
+            pending_notifications = []
+            pending_audits = []
+            manager = self.find_manager_to_escalate_to(db) if tasks else None
             
             for task in tasks:
-                should_escalate, reason = self.should_escalate(task)
+                should_escalate, reason = self.should_escalate(task, now)
                 
                 if should_escalate:
-                    manager = self.find_manager_to_escalate_to(task, db)
                     if manager:
-                        self.escalate_task(task, reason, manager, db)
+                        notifications, audit_log = self.escalate_task(task, reason, manager)
+                        pending_notifications.extend(notifications)
+                        pending_audits.append(audit_log)
                         escalated_count += 1
                         logger.info(f"[{self.agent_name}] Escalated task {task.id}: {task.title}")
             
-            db.commit()
-            
-            # Update agent status
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            # One multi-row INSERT per table
+            db.add_all(pending_notifications)
+            bulk_write_audit(db, pending_audits)
             
+            # Update agent status in the same transaction as the agent's work
+            agent_status = self.get_agent_status(db)
             if agent_status:
-                agent_status.last_run = datetime.utcnow()
+                agent_status.last_run = func.now()
                 agent_status.tasks_processed += len(tasks)
-                db.commit()
+            
+            db.commit()
             
             logger.info(f"[{self.agent_name}] Checked {len(tasks)} tasks, escalated {escalated_count}")
             
         except Exception as e:
             logger.error(f"[{self.agent_name}] Error: {str(e)}")
+            db.rollback()
             
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            agent_status = self.get_agent_status(db)
             if agent_status:
                 agent_status.errors_count += 1
                 agent_status.last_error = str(e)
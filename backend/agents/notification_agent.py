@@ -2,13 +2,22 @@
 Notification Agent - Manages scheduled notifications and reminders
 """
 import logging
+import bisect
 from datetime import datetime, timedelta
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 from database import SessionLocal
+from audit_writer import bulk_write_audit
+from websocket_manager import manager
+from routers.notifications import notification_topic
 import models
 
 logger = logging.getLogger(__name__)
 
+# Reminder label by hours before due: up to 1h, up to 8h, anything longer
+_REMINDER_THRESHOLDS = [1, 8]
+_REMINDER_LABELS = ["🔴 URGENT", "🟡 WARNING", "🔔 REMINDER"]
+
 
 class NotificationAgent:
     """
@@ -20,26 +29,18 @@ class NotificationAgent:
     
     def __init__(self):
         self.agent_name = "NotificationAgent"
+        self._status_id = None  # AgentStatus primary key, resolved on first run
         self.reminder_hours = [24, 8, 2]  # Remind at 24h, 8h, and 2h before due
     
-    def create_reminder(self, task: models.Task, hours_before: int, db: Session):
-        """Create a reminder notification for a task"""
-        # Check if reminder already exists
-        existing = db.query(models.Notification).filter(
-            models.Notification.task_id == task.id,
-            models.Notification.type == "reminder",
-            models.Notification.message.contains(f"{hours_before} hour")
-        ).first()
-        
-        if existing:
+    def create_reminder(self, task: models.Task, hours_before: int, existing_reminders: set):
+        """
+        Create a reminder notification for a task
+        existing_reminders: set of (task_id, hours_before) pairs already reminded
+        """
+        if (task.id, hours_before) in existing_reminders:
             return None
         
-        if hours_before == 1:
-            urgency = "🔴 URGENT"
-        elif hours_before <= 8:
-            urgency = "🟡 WARNING"
-        else:
-            urgency = "🔔 REMINDER"
+        urgency = _REMINDER_LABELS[bisect.bisect_left(_REMINDER_THRESHOLDS, hours_before)]
         
         notification = models.Notification(
             type="reminder",
@@ -47,7 +48,8 @@ class NotificationAgent:
             channel=models.NotificationChannel.DESKTOP,
             user_id=task.assigned_to,
             task_id=task.id,
-            scheduled_at=task.due_date - timedelta(hours=hours_before)
+            scheduled_at=task.due_date - timedelta(hours=hours_before),
+            reminder_hours_before=hours_before
         )
         
         return notification
@@ -62,22 +64,30 @@ class NotificationAgent:
             models.Notification.scheduled_at <= now
         ).all()
         
-        sent_count = 0
+        sent_ids = []
+        failed_ids = []
         for notification in pending:
             try:
                 # Simulate sending (in production, would actually send email/desktop notification)
-                notification.status = models.NotificationStatus.SENT
-                notification.sent_at = now
-                sent_count += 1
+                sent_ids.append(notification.id)
                 
                 logger.info(f"[{self.agent_name}] Sent notification {notification.id}: {notification.message[:50]}...")
                 
             except Exception as e:
-                notification.status = models.NotificationStatus.FAILED
-                notification.retry_count += 1
+                failed_ids.append(notification.id)
                 logger.error(f"[{self.agent_name}] Failed to send notification {notification.id}: {str(e)}")
         
-        return sent_count
+        # Apply the status transitions with one UPDATE per outcome
+        self.bulk_update_notifications(db, sent_ids, {
+            models.Notification.status: models.NotificationStatus.SENT,
+            models.Notification.sent_at: func.now()
+        })
+        self.bulk_update_notifications(db, failed_ids, {
+            models.Notification.status: models.NotificationStatus.FAILED,
+            models.Notification.retry_count: models.Notification.retry_count + 1
+        })
+        
+        return len(sent_ids)
     
     def retry_failed_notifications(self, db: Session) -> int:
         """Retry sending failed notifications"""
@@ -86,42 +96,77 @@ class NotificationAgent:
             models.Notification.retry_count < models.Notification.max_retries
         ).all()
         
-        retry_count = 0
+        sent_ids = []
+        retrying_ids = []
+        exhausted_ids = []
+        audit_logs = []
         for notification in failed:
             try:
-                notification.status = models.NotificationStatus.RETRYING
-                
                 # Simulate retry (in production, would actually resend)
-                notification.status = models.NotificationStatus.SENT
-                notification.sent_at = datetime.utcnow()
-                retry_count += 1
+                sent_ids.append(notification.id)
                 
                 # Log successful retry
-                audit_log = models.AuditLog(
-                    action="notification_retry_success",
-                    entity_type="notification",
-                    entity_id=notification.id,
-                    agent_involved=self.agent_name,
-                    details=f"Notification sent after {notification.retry_count} retries"
-                )
-                db.add(audit_log)
+                audit_logs.append({
+                    "action": "notification_retry_success",
+                    "entity_type": "notification",
+                    "entity_id": notification.id,
+                    "agent_involved": self.agent_name,
+                    "details": f"Notification sent after {notification.retry_count} retries"
+                })
                 
             except Exception as e:
-                notification.retry_count += 1
-                if notification.retry_count >= notification.max_retries:
-                    notification.status = models.NotificationStatus.FAILED
+                if notification.retry_count + 1 < notification.max_retries:
+                    retrying_ids.append(notification.id)
+                else:
+                    exhausted_ids.append(notification.id)
                     
                     # Notify about permanent failure
-                    audit_log = models.AuditLog(
-                        action="notification_permanently_failed",
-                        entity_type="notification",
-                        entity_id=notification.id,
-                        agent_involved=self.agent_name,
-                        details=f"Notification failed after {notification.max_retries} retries"
-                    )
-                    db.add(audit_log)
-        
-        return retry_count
+                    audit_logs.append({
+                        "action": "notification_permanently_failed",
+                        "entity_type": "notification",
+                        "entity_id": notification.id,
+                        "agent_involved": self.agent_name,
+                        "details": f"Notification failed after {notification.max_retries} retries"
+                    })
+        
+        # Apply the status transitions with one UPDATE per outcome
+        self.bulk_update_notifications(db, sent_ids, {
+            models.Notification.status: models.NotificationStatus.SENT,
+            models.Notification.sent_at: func.now()
+        })
+        self.bulk_update_notifications(db, retrying_ids, {
+            models.Notification.status: models.NotificationStatus.RETRYING,
+            models.Notification.retry_count: models.Notification.retry_count + 1
+        })
+        self.bulk_update_notifications(db, exhausted_ids, {
+            models.Notification.status: models.NotificationStatus.FAILED,
+            models.Notification.retry_count: models.Notification.retry_count + 1
+        })
+        bulk_write_audit(db, audit_logs)
+        
+        return len(sent_ids)
+    
+    def bulk_update_notifications(self, db: Session, notification_ids: list, values: dict):
+        """Apply the same column values to all given notifications in a single UPDATE"""
+        if not notification_ids:
+            return
+        
+        updated = db.execute(
+            update(models.Notification).where(
+                models.Notification.id.in_(notification_ids)
+            ).values(values).returning(models.Notification.id, models.Notification.user_id, *values)
+        ).all()
+        
+        # The bulk UPDATE skips the ORM listeners, so announce the new values here
+        # and have the commit drop the affected users' cached stats
+        for notification_id, user_id, *new_values in updated:
+            topic = notification_topic(user_id)
+            if manager.has_subscribers(topic):
+                manager.publish_after_commit(db, topic, {
+                    "type": "NOTIFICATION_UPDATE",
+                    "data": {"id": notification_id, "changes": {column.key: value for column, value in zip(values, new_values)}}
+                })
+        db.info.setdefault("stale_notification_users", set()).update(user_id for _, user_id, *_ in updated)
     
     def schedule_upcoming_reminders(self, db: Session) -> int:
         """Schedule reminders for tasks with upcoming due dates"""
@@ -137,19 +182,43 @@ class NotificationAgent:
             models.Task.due_date <= reminder_window
         ).all()
         
+        if not tasks:
+            return 0
+        
+        # Load all existing reminders for these tasks in one query
+        existing_reminders = set(db.query(
+            models.Notification.task_id,
+            models.Notification.reminder_hours_before
+        ).filter(
+            models.Notification.task_id.in_([task.id for task in tasks]),
+            models.Notification.type == "reminder"
+        ).all())
+        
         created_count = 0
         for task in tasks:
             hours_until_due = (task.due_date - now).total_seconds() / 3600
             
             for reminder_hour in self.reminder_hours:
                 if hours_until_due <= reminder_hour and hours_until_due > reminder_hour - 1:
-                    notification = self.create_reminder(task, reminder_hour, db)
+                    notification = self.create_reminder(task, reminder_hour, existing_reminders)
                     if notification:
                         db.add(notification)
                         created_count += 1
         
         return created_count
     
+    def get_agent_status(self, db: Session) -> models.AgentStatus:
+        """Load this agent's status row, by primary key once it is known"""
+        if self._status_id is not None:
+            return db.get(models.AgentStatus, self._status_id)
+        
+        agent_status = db.query(models.AgentStatus).filter(
+            models.AgentStatus.agent_name == self.agent_name
+        ).first()
+        if agent_status:
+            self._status_id = agent_status.id
+        return agent_status
+    
     def run(self):
         """Execute notification agent job"""
         logger.info(f"[{self.agent_name}] Starting notification processing...")
@@ -165,26 +234,21 @@ class NotificationAgent:
             # Retry failed notifications
             retried = self.retry_failed_notifications(db)
             
-            db.commit()
-            
-            # Update agent status
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
-            
+            # Update agent status in the same transaction as the agent's work
+            agent_status = self.get_agent_status(db)
             if agent_status:
-                agent_status.last_run = datetime.utcnow()
+                agent_status.last_run = func.now()
                 agent_status.tasks_processed += sent + retried
-                db.commit()
+            
+            db.commit()
             
             logger.info(f"[{self.agent_name}] Scheduled {scheduled}, sent {sent}, retried {retried} notifications")
             
         except Exception as e:
             logger.error(f"[{self.agent_name}] Error: {str(e)}")
+            db.rollback()
             
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            agent_status = self.get_agent_status(db)
             if agent_status:
                 agent_status.errors_count += 1
                 agent_status.last_error = str(e)
@@ -3,12 +3,32 @@ Planning Agent - Analyzes tasks and calculates priority scores
 """
 import logging
 from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func, String, type_coerce
 from sqlalchemy.orm import Session
 from database import SessionLocal
+from audit_writer import bulk_write_audit
 import models
 
 logger = logging.getLogger(__name__)
 
+# Priority level points (0-25)
+_PRIORITY_WEIGHTS = {
+    models.TaskPriority.CRITICAL: 25,
+    models.TaskPriority.HIGH: 20,
+    models.TaskPriority.MEDIUM: 10,
+    models.TaskPriority.LOW: 5
+}
+
+# The same weights keyed by the enum name stored in the priority column,
+# for scans that read the raw column instead of coercing each row to an enum
+_PRIORITY_WEIGHTS_BY_NAME = {priority.name: weight for priority, weight in _PRIORITY_WEIGHTS.items()}
+
+# Due date urgency points (0-30): _URGENCY_POINTS[i] applies below _URGENCY_THRESHOLDS[i]
+# hours remaining (overdue, 24h, 48h, 3 days, a week); the final 0 is for later due dates
+_URGENCY_THRESHOLDS = [0, 24, 48, 72, 168]
+_URGENCY_POINTS = [30, 25, 20, 15, 10, 0]
+
 
 class PlanningAgent:
     """
@@ -20,55 +40,34 @@ class PlanningAgent:
     
     def __init__(self):
         self.agent_name = "PlanningAgent"
+        self._status_id = None  # AgentStatus primary key, resolved on first run
     
-    def calculate_priority_score(self, task: models.Task) -> float:
+    def calculate_priority_scores(self, due_dates: list, priorities: list, created_ats: list,
+                                  dependent_counts: list, now: datetime) -> np.ndarray:
         """
-        Calculate priority score (0-100) based on multiple factors:
-        - Due date urgency
-        - Task priority level
-        - Number of dependent tasks
-        - Current status
+        Calculate priority scores (0-100) as of `now` over column arrays (one entry
+        per task) from due date urgency, priority level, number of dependent tasks
+        and task age; priorities are the stored TaskPriority names (e.g. "HIGH").
         """
-        score = 50.0  # Base score
+        now64 = np.datetime64(now, "us")
         
         # 1. Due date urgency (0-30 points)
-        if task.due_date:
-            now = datetime.utcnow()
-            time_remaining = (task.due_date - now).total_seconds() / 3600  # hours
-            
-            if time_remaining < 0:  # Overdue
-                score += 30
-            elif time_remaining < 24:  # Due within 24 hours
-                score += 25
-            elif time_remaining < 48:  # Due within 48 hours
-                score += 20
-            elif time_remaining < 72:  # Due within 3 days
-                score += 15
-            elif time_remaining < 168:  # Due within a week
-                score += 10
+        # Missing due dates give NaN hours, which sort past the last threshold (0 points)
+        hours_remaining = (np.array(due_dates, dtype="datetime64[us]") - now64) / np.timedelta64(1, "h")
+        urgency = np.array(_URGENCY_POINTS)[np.searchsorted(_URGENCY_THRESHOLDS, hours_remaining, side="right")]
         
         # 2. Priority level (0-25 points)
-        priority_weights = {
-            models.TaskPriority.CRITICAL: 25,
-            models.TaskPriority.HIGH: 20,
-            models.TaskPriority.MEDIUM: 10,
-            models.TaskPriority.LOW: 5
-        }
-        score += priority_weights.get(task.priority, 10)
+        weights = np.array([_PRIORITY_WEIGHTS_BY_NAME.get(p, 10) for p in priorities], dtype=float)
         
         # 3. Dependent tasks (0-15 points)
-        # More tasks depending on this one = higher priority
-        dependent_count = len(task.dependent_tasks) if hasattr(task, 'dependent_tasks') else 0
-        score += min(dependent_count * 5, 15)
+        dependents = np.minimum(np.array(dependent_counts, dtype=float) * 5, 15)
         
-        # 4. Task age (0-10 points)
-        # Older incomplete tasks get higher priority
-        if task.created_at:
-            age_days = (datetime.utcnow() - task.created_at).days
-            score += min(age_days, 10)
+        # 4. Task age (0-10 points), whole days like timedelta.days
+        created = np.array(created_ats, dtype="datetime64[us]")
+        age_days = np.floor((now64 - created) / np.timedelta64(1, "D"))
+        age = np.where(np.isnat(created), 0, np.minimum(age_days, 10))
         
-        # Cap score at 100
-        return min(score, 100.0)
+        return np.minimum(50.0 + urgency + weights + dependents + age, 100.0)
     
     def analyze_dependencies(self, task: models.Task, db: Session) -> dict:
         """Analyze task dependencies and identify blockers"""
@@ -99,61 +98,93 @@ class PlanningAgent:
         
         return result
     
+    def get_agent_status(self, db: Session) -> models.AgentStatus:
+        """Load this agent's status row, by primary key once it is known"""
+        if self._status_id is not None:
+            return db.get(models.AgentStatus, self._status_id)
+        
+        agent_status = db.query(models.AgentStatus).filter(
+            models.AgentStatus.agent_name == self.agent_name
+        ).first()
+        if agent_status:
+            self._status_id = agent_status.id
+        return agent_status
+    
     def run(self):
         """Execute planning agent job"""
         logger.info(f"[{self.agent_name}] Starting task analysis...")
         
+        now = datetime.utcnow()
         db = SessionLocal()
         try:
-            # Get all active tasks
-            tasks = db.query(models.Task).filter(
+            # Number of tasks depending on each task
+            dependents = db.query(
+                models.task_dependencies.c.dependency_id.label("task_id"),
+                func.count().label("dependent_count")
+            ).group_by(models.task_dependencies.c.dependency_id).subquery()
+            
+            # Get the scoring columns of all active tasks
+            tasks = db.query(
+                models.Task.id,
+                models.Task.due_date,
+                type_coerce(models.Task.priority, String),
+                models.Task.created_at,
+                models.Task.priority_score,
+                func.coalesce(dependents.c.dependent_count, 0)
+            ).outerjoin(
+                dependents, dependents.c.task_id == models.Task.id
+            ).filter(
                 models.Task.status.in_([
                     models.TaskStatus.PENDING,
                     models.TaskStatus.IN_PROGRESS
                 ])
             ).all()
             
-            updated_count = 0
-            for task in tasks:
-                old_score = task.priority_score
-                new_score = self.calculate_priority_score(task)
-                
+            ids, due_dates, priorities, created_ats, old_scores, dependent_counts = list(zip(*tasks)) or [()] * 6
+            new_scores = self.calculate_priority_scores(
+                due_dates, priorities, created_ats, dependent_counts, now
+            )
+            
+            score_updates = []
+            audit_logs = []
+            for task_id, old_score, new_score in zip(ids, old_scores, new_scores.tolist()):
                 if abs(old_score - new_score) > 1:  # Only update if significant change
-                    task.priority_score = new_score
-                    updated_count += 1
+                    score_updates.append({"id": task_id, "priority_score": new_score})
                     
                     # Log significant priority changes
                     if new_score - old_score > 10:
-                        audit_log = models.AuditLog(
-                            action="priority_increased",
-                            entity_type="task",
-                            entity_id=task.id,
-                            agent_involved=self.agent_name,
-                            details=f"Priority score increased from {old_score:.1f} to {new_score:.1f}"
-                        )
-                        db.add(audit_log)
-            
-            db.commit()
+                        audit_logs.append({
+                            "action": "priority_increased",
+                            "entity_type": "task",
+                            "entity_id": task_id,
+                            "agent_involved": self.agent_name,
+                            "details": f"Priority score increased from {old_score:.1f} to {new_score:.1f}"
+                        })
             
-            # Update agent status
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            # Write all score changes and audit entries in batched statements
+            if score_updates:
+                db.bulk_update_mappings(models.Task, score_updates)
+                # Bulk updates skip the flush hooks; have the commit drop the cached task stats
+                db.info["stale_task_stats"] = True
+            bulk_write_audit(db, audit_logs)
+            updated_count = len(score_updates)
             
+            # Update agent status in the same transaction as the agent's work
+            agent_status = self.get_agent_status(db)
             if agent_status:
-                agent_status.last_run = datetime.utcnow()
+                agent_status.last_run = func.now()
                 agent_status.tasks_processed += len(tasks)
-                db.commit()
+            
+            db.commit()
             
             logger.info(f"[{self.agent_name}] Analyzed {len(tasks)} tasks, updated {updated_count} priority scores")
             
         except Exception as e:
             logger.error(f"[{self.agent_name}] Error: {str(e)}")
+            db.rollback()
             
             # Log error
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            agent_status = self.get_agent_status(db)
             if agent_status:
                 agent_status.errors_count += 1
                 agent_status.last_error = str(e)
@@ -3,12 +3,22 @@ Risk Agent - Monitors risk factors and calculates confidence scores
 """
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+import numpy as np
+from sqlalchemy import func, case, and_, String, type_coerce
+from sqlalchemy.orm import Session, aliased
 from database import SessionLocal
+from audit_writer import bulk_write_audit
+from websocket_manager import manager
+from routers.tasks import subscribed_task_topics
 import models
 
 logger = logging.getLogger(__name__)
 
+# Time factor penalty (0-40): _TIME_PENALTIES[i] applies below _TIME_THRESHOLDS[i]
+# hours remaining (overdue, 8h, 24h, 48h); the final 0 is for later due dates
+_TIME_THRESHOLDS = [0, 8, 24, 48]
+_TIME_PENALTIES = [40, 30, 20, 10, 0]
+
 
 class RiskAgent:
     """
@@ -20,89 +30,127 @@ class RiskAgent:
     
     def __init__(self):
         self.agent_name = "RiskAgent"
+        self._status_id = None  # AgentStatus primary key, resolved on first run
         self.low_confidence_threshold = 40.0
     
-    def calculate_confidence_score(self, task: models.Task, db: Session) -> float:
+    def calculate_confidence_scores(self, due_dates: list, priorities: list, statuses: list,
+                                    incomplete_deps: list, risky_deps: list, now: datetime) -> np.ndarray:
         """
-        Calculate confidence score (0-100) based on risk factors:
-        - Time remaining vs estimated effort
-        - Dependency completion status
-        - Historical completion rates
-        - Task priority level
+        Calculate confidence scores (0-100) as of `now` over column arrays (one entry
+        per task) from time remaining, dependency risk, priority and status.
+        priorities / statuses are the stored enum names (e.g. "HIGH", "PENDING");
+        incomplete_deps / risky_deps are per-task counts of unfinished dependencies
+        and of unfinished dependencies with confidence below 50.
         """
-        score = 100.0  # Start at full confidence
+        now64 = np.datetime64(now, "us")
+        due = np.array(due_dates, dtype="datetime64[us]")
+        priorities = np.array(priorities, dtype="U16")
+        statuses = np.array(statuses, dtype="U16")
         
-        # 1. Time factor (-0 to -40 points)
-        if task.due_date:
-            now = datetime.utcnow()
-            time_remaining = (task.due_date - now).total_seconds() / 3600  # hours
-            
-            if time_remaining < 0:  # Overdue
-                score -= 40
-            elif time_remaining < 8:  # Less than 8 hours
-                score -= 30
-            elif time_remaining < 24:  # Less than 24 hours
-                score -= 20
-            elif time_remaining < 48:  # Less than 48 hours
-                score -= 10
+        until_due = due - now64
         
-        # 2. Dependency risk (-0 to -30 points)
-        incomplete_deps = 0
-        for dep in task.dependencies:
-            if dep.status != models.TaskStatus.COMPLETED:
-                incomplete_deps += 1
-                # Check if dependency is also at risk
-                if dep.confidence_score < 50:
-                    score -= 10  # Extra penalty for risky dependencies
+        # 1. Time factor (-0 to -40 points)
+        hours_remaining = until_due / np.timedelta64(1, "h")
+        time_penalty = np.array(_TIME_PENALTIES)[np.searchsorted(_TIME_THRESHOLDS, hours_remaining, side="right")]
         
-        score -= min(incomplete_deps * 10, 30)
+        # 2. Dependency risk (-0 to -30 points, plus -10 per risky dependency)
+        dependency_penalty = (np.minimum(np.array(incomplete_deps, dtype=float) * 10, 30)
+                              + np.array(risky_deps, dtype=float) * 10)
         
         # 3. Task complexity/priority risk (-0 to -15 points)
-        if task.priority == models.TaskPriority.CRITICAL:
-            score -= 10  # Critical tasks are inherently riskier
-        elif task.priority == models.TaskPriority.HIGH:
-            score -= 5
+        priority_penalty = np.select(
+            [priorities == models.TaskPriority.CRITICAL.name, priorities == models.TaskPriority.HIGH.name],
+            [10, 5],
+            default=0
+        )
         
-        # 4. Status factor
-        if task.status == models.TaskStatus.PENDING:
-            # Not started yet - reduce confidence
-            if task.due_date:
-                days_until_due = (task.due_date - datetime.utcnow()).days
-                if days_until_due < 2 and task.priority in [models.TaskPriority.HIGH, models.TaskPriority.CRITICAL]:
-                    score -= 15  # High priority not started with little time
+        # 4. Status factor - high priority, not started, due within 2 days
+        days_until_due = np.floor(until_due / np.timedelta64(1, "D"))
+        not_started = (
+            (statuses == models.TaskStatus.PENDING.name)
+            & (days_until_due < 2)
+            & np.isin(priorities, [models.TaskPriority.HIGH.name, models.TaskPriority.CRITICAL.name])
+        )
+        status_penalty = np.where(not_started, 15, 0)
         
-        # Ensure score stays within bounds
-        return max(0.0, min(100.0, score))
+        score = 100.0 - time_penalty - dependency_penalty - priority_penalty - status_penalty
+        return np.clip(score, 0.0, 100.0)
     
     def identify_bottlenecks(self, db: Session) -> list:
         """Identify tasks that are blocking multiple other tasks"""
-        bottlenecks = []
-        
-        tasks = db.query(models.Task).filter(
+        # Count dependents per unfinished task in SQL, keeping tasks blocking 2+ others
+        blocking_count = func.count(models.task_dependencies.c.task_id)
+        rows = db.query(
+            models.Task.id,
+            models.Task.title,
+            models.Task.confidence_score,
+            models.Task.status,
+            blocking_count
+        ).join(
+            models.task_dependencies, models.task_dependencies.c.dependency_id == models.Task.id
+        ).filter(
             models.Task.status != models.TaskStatus.COMPLETED
-        ).all()
+        ).group_by(
+            models.Task.id
+        ).having(
+            blocking_count >= 2
+        ).order_by(blocking_count.desc(), models.Task.id).all()
         
-        for task in tasks:
-            blocked_count = len(task.dependent_tasks)
-            if blocked_count >= 2:  # Task is blocking 2+ other tasks
-                bottlenecks.append({
-                    "task_id": task.id,
-                    "title": task.title,
-                    "blocking_count": blocked_count,
-                    "confidence_score": task.confidence_score,
-                    "status": task.status.value
-                })
+        return [
+            {
+                "task_id": task_id,
+                "title": title,
+                "blocking_count": count,
+                "confidence_score": confidence_score,
+                "status": status.value
+            }
+            for task_id, title, confidence_score, status, count in rows
+        ]
+    
+    def get_agent_status(self, db: Session) -> models.AgentStatus:
+        """Load this agent's status row, by primary key once it is known"""
+        if self._status_id is not None:
+            return db.get(models.AgentStatus, self._status_id)
         
-        return sorted(bottlenecks, key=lambda x: x["blocking_count"], reverse=True)
+        agent_status = db.query(models.AgentStatus).filter(
+            models.AgentStatus.agent_name == self.agent_name
+        ).first()
+        if agent_status:
+            self._status_id = agent_status.id
+        return agent_status
     
     def run(self):
         """Execute risk agent job"""
         logger.info(f"[{self.agent_name}] Starting risk assessment...")
         
+        now = datetime.utcnow()
         db = SessionLocal()
         try:
-            # Get all active tasks
-            tasks = db.query(models.Task).filter(
+            # Per-task counts of unfinished (and unfinished, risky) dependencies
+            dep = aliased(models.Task)
+            unfinished = dep.status != models.TaskStatus.COMPLETED
+            dependency_stats = db.query(
+                models.task_dependencies.c.task_id.label("task_id"),
+                func.sum(case((unfinished, 1), else_=0)).label("incomplete_deps"),
+                func.sum(case((and_(unfinished, dep.confidence_score < 50), 1), else_=0)).label("risky_deps")
+            ).join(
+                dep, dep.id == models.task_dependencies.c.dependency_id
+            ).group_by(models.task_dependencies.c.task_id).subquery()
+            
+            # Get the scoring columns of all active tasks
+            tasks = db.query(
+                models.Task.id,
+                models.Task.title,
+                models.Task.assigned_to,
+                models.Task.due_date,
+                type_coerce(models.Task.priority, String),
+                type_coerce(models.Task.status, String),
+                models.Task.confidence_score,
+                func.coalesce(dependency_stats.c.incomplete_deps, 0),
+                func.coalesce(dependency_stats.c.risky_deps, 0)
+            ).outerjoin(
+                dependency_stats, dependency_stats.c.task_id == models.Task.id
+            ).filter(
                 models.Task.status.in_([
                     models.TaskStatus.PENDING,
                     models.TaskStatus.IN_PROGRESS
@@ -110,15 +158,26 @@ class RiskAgent:
             ).all()
             
             high_risk_count = 0
-            updated_count = 0
+            score_updates = []
+            pending_audits = []
+            pending_notifications = []
+            
+            _, _, _, due_dates, priorities, statuses, _, incomplete_deps, risky_deps = list(zip(*tasks)) or [()] * 9
+            new_scores = self.calculate_confidence_scores(
+                due_dates, priorities, statuses, incomplete_deps, risky_deps, now
+            )
             
-            for task in tasks:
+            for task, new_score in zip(tasks, new_scores.tolist()):
                 old_score = task.confidence_score
-                new_score = self.calculate_confidence_score(task, db)
                 
                 if abs(old_score - new_score) > 2:  # Only update if significant change
-                    task.confidence_score = new_score
-                    updated_count += 1
+                    score_updates.append({"id": task.id, "confidence_score": new_score})
+                    # The bulk UPDATE skips the task listeners; queue the client delta here
+                    for topic in subscribed_task_topics(task.assigned_to):
+                        manager.publish_after_commit(db, topic, {
+                            "type": "TASK_UPDATE",
+                            "data": {"id": task.id, "changes": {"confidence_score": new_score}}
+                        })
                     
                     # Check if newly high-risk
                     if new_score < self.low_confidence_threshold:
@@ -126,45 +185,50 @@ class RiskAgent:
                         
                         # Log the risk detection
                         if old_score >= self.low_confidence_threshold:
-                            audit_log = models.AuditLog(
-                                action="high_risk_detected",
-                                entity_type="task",
-                                entity_id=task.id,
-                                agent_involved=self.agent_name,
-                                details=f"Task '{task.title}' dropped to high-risk status. Confidence: {new_score:.1f}%"
-                            )
-                            db.add(audit_log)
+                            pending_audits.append({
+                                "action": "high_risk_detected",
+                                "entity_type": "task",
+                                "entity_id": task.id,
+                                "agent_involved": self.agent_name,
+                                "details": f"Task '{task.title}' dropped to high-risk status. Confidence: {new_score:.1f}%"
+                            })
                             
                             # Create notification for assignee
-                            notification = models.Notification(
+                            pending_notifications.append(models.Notification(
                                 type="alert",
                                 message=f"⚠️ Task '{task.title}' has been flagged as HIGH RISK (Confidence: {new_score:.0f}%)",
                                 channel=models.NotificationChannel.DESKTOP,
                                 user_id=task.assigned_to,
                                 task_id=task.id
-                            )
-                            db.add(notification)
+                            ))
             
-            db.commit()
+            # Write all score changes in one batched UPDATE
+            if score_updates:
+                db.bulk_update_mappings(models.Task, score_updates)
+                # Bulk updates skip the flush hooks; have the commit drop the cached task stats
+                db.info["stale_task_stats"] = True
             
-            # Update agent status
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            # One multi-row INSERT per table: audit logs go out to clients as one
+            # batch message, notifications through their per-row listeners
+            bulk_write_audit(db, pending_audits)
+            db.add_all(pending_notifications)
+            updated_count = len(score_updates)
             
+            # Update agent status in the same transaction as the agent's work
+            agent_status = self.get_agent_status(db)
             if agent_status:
-                agent_status.last_run = datetime.utcnow()
+                agent_status.last_run = func.now()
                 agent_status.tasks_processed += len(tasks)
-                db.commit()
+            
+            db.commit()
             
             logger.info(f"[{self.agent_name}] Assessed {len(tasks)} tasks, updated {updated_count} scores, found {high_risk_count} high-risk")
             
         except Exception as e:
             logger.error(f"[{self.agent_name}] Error: {str(e)}")
+            db.rollback()
             
-            agent_status = db.query(models.AgentStatus).filter(
-                models.AgentStatus.agent_name == self.agent_name
-            ).first()
+            agent_status = self.get_agent_status(db)
             if agent_status:
                 agent_status.errors_count += 1
                 agent_status.last_error = str(e)
@@ -0,0 +1,84 @@
+"""
+Bulk audit log writes for the AI agents and the API
+One multi-row INSERT per batch, announced to WebSocket clients as a single message
+"""
+import logging
+import queue
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from database import SessionLocal
+import models
+from websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Fields sent to clients for each log, matching the AUDIT_LOG message
+AUDIT_LOG_FIELDS = ("action", "details", "entity_type", "entity_id", "agent_involved", "user_id")
+
+# Audit logs not tied to another write, queued off the request path and
+# written by the scheduler's flush job
+audit_queue = queue.Queue()
+AUDIT_FLUSH_BATCH_SIZE = 500
+
+
+def bulk_write_audit(db: Session, rows: list):
+    """
+    Insert audit log rows (dicts of AuditLog columns) in one statement.
+    Bypasses the per-row ORM events; once the session commits, the rows are
+    broadcast together as one AUDIT_LOG_BATCH message.
+    """
+    if not rows:
+        return
+    
+    timestamp = datetime.utcnow()
+    for row in rows:
+        row.setdefault("timestamp", timestamp)
+    
+    # RETURNING ids come back in the order of rows, so they pair up by position
+    ids = db.scalars(
+        insert(models.AuditLog).returning(models.AuditLog.id, sort_by_parameter_order=True),
+        rows
+    ).all()
+    
+    if manager.has_subscribers("audit"):
+        manager.publish_after_commit(db, "audit", {
+            "type": "AUDIT_LOG_BATCH",
+            "data": [
+                {"id": log_id, "timestamp": row["timestamp"], **{field: row.get(field) for field in AUDIT_LOG_FIELDS}}
+                for log_id, row in zip(ids, rows)
+            ]
+        })
+
+
+def queue_audit(row: dict):
+    """Record an audit log (dict of AuditLog columns) without writing it in the caller's transaction"""
+    row.setdefault("timestamp", datetime.utcnow())
+    audit_queue.put_nowait(row)
+
+
+def flush_audit_queue():
+    """Write queued audit logs, one transaction per batch"""
+    while True:
+        batch = []
+        while len(batch) < AUDIT_FLUSH_BATCH_SIZE:
+            try:
+                batch.append(audit_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        
+        db = SessionLocal()
+        try:
+            bulk_write_audit(db, batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Keep the logs for the next flush (e.g. after the database was busy)
+            for row in batch:
+                audit_queue.put_nowait(row)
+            logger.exception(f"Failed to write {len(batch)} queued audit logs, retrying on the next flush")
+            return
+        finally:
+            db.close()
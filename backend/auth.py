@@ -4,40 +4,118 @@ JWT Token-based authentication with password hashing
 """
 from datetime import datetime, timedelta
 from typing import Optional
+import functools
+import logging
+import os
+import time
 from jose import JWTError, jwt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 import hashlib
-import secrets
+import hmac
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from database import get_db
+from cache import TTLCache
 import models
 
+logger = logging.getLogger(__name__)
+
 # Configuration
-SECRET_KEY = "erp-agentic-ai-secret-key-2026"
+SECRET_KEY = os.environ.get("JWT_SECRET")
+if not SECRET_KEY:
+    # Development fallback only; anyone with the source can forge tokens signed with it
+    SECRET_KEY = "erp-agentic-ai-secret-key-2026"
+    logger.warning("JWT_SECRET is not set, using the built-in development key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Argon2id password hashing (RFC 9106 style parameters: 3 passes, 64 MiB, 4 lanes)
+password_hasher = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=4, hash_len=32)
+
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/login")
 
+# Role sets checked by the admin / manager dependencies
+ADMIN_ROLES = frozenset({models.UserRole.ADMIN})
+MANAGER_OR_ADMIN_ROLES = frozenset({models.UserRole.ADMIN, models.UserRole.MANAGER})
+
+# Decoded JWT payloads keyed by raw token, so repeat requests skip signature checks
+token_cache = TTLCache(maxsize=10_000, ttl=60)
+
+# Recently verified logins, so clients re-authenticating in a loop skip Argon2.
+# Keyed by an HMAC of the stored hash and the password: nothing usable offline
+# is kept, and changing the password changes the key
+verified_logins = TTLCache(maxsize=10_000, ttl=60)
+
+# Failed login attempts per (email, client IP); further attempts from that client
+# are refused until the window passes without a new failure. Keyed by client too,
+# so guessing at an account from one address doesn't lock its owner out
+failed_logins = TTLCache(maxsize=10_000, ttl=300)
+MAX_FAILED_LOGINS = 5
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
+    """Verify a password against its hash (Argon2id, or a legacy salted SHA-256 hash)"""
+    if not hashed_password.startswith("$argon2"):
+        return verify_legacy_password(plain_password, hashed_password)
+    
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def verify_legacy_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against a pre-Argon2 hash"""
     # Hash format: salt$hash
     try:
         salt, stored_hash = hashed_password.split('$')
-        test_hash = hashlib.sha256((salt + plain_password).encode()).hexdigest()
-        return test_hash == stored_hash
-    except:
+    except ValueError:
         return False
+    
+    test_hash = hashlib.sha256((salt + plain_password).encode()).hexdigest()
+    return hmac.compare_digest(test_hash.encode(), stored_hash.encode())
+
+
+def verify_login_password(plain_password: str, hashed_password: str) -> bool:
+    """verify_password, skipped for a password verified against the same hash within the last minute"""
+    key = hmac.new(
+        SECRET_KEY.encode(),
+        f"{hashed_password}\0{plain_password}".encode(),
+        hashlib.sha256
+    ).digest()
+    if verified_logins.get(key):
+        return True
+    
+    if not verify_password(plain_password, hashed_password):
+        return False
+    verified_logins.set(key, True)
+    return True
+
+
+def too_many_failed_logins(email: str, client_ip: Optional[str]) -> bool:
+    """Whether logins for this email from this client are temporarily refused"""
+    return failed_logins.get((email, client_ip), 0) >= MAX_FAILED_LOGINS
+
+
+def record_failed_login(email: str, client_ip: Optional[str]):
+    """Count a failed login attempt for this email from this client"""
+    key = (email, client_ip)
+    failed_logins.set(key, failed_logins.get(key, 0) + 1)
 
 
 def get_password_hash(password: str) -> str:
     """Generate password hash"""
-    salt = secrets.token_hex(16)
-    hash_value = hashlib.sha256((salt + password).encode()).hexdigest()
-    return f"{salt}${hash_value}"
+    return password_hasher.hash(password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Whether a stored hash is legacy or uses outdated Argon2 parameters"""
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -54,18 +132,32 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 def decode_token(token: str) -> dict:
     """Decode and verify JWT token"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    
+    # Never serve a cached payload past the token's own expiry
+    ttl = token_cache.ttl
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    token_cache.set(token, payload, ttl)
+    return payload
 
 
-async def get_current_user(
+def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> models.User:
-    """Get current user from JWT token"""
+    """
+    Get current user from JWT token.
+    A plain def so FastAPI runs the user lookup in its threadpool
+    instead of blocking the event loop on every authenticated request.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -76,16 +168,13 @@ async def get_current_user(
     if payload is None:
         raise credentials_exception
     
-    user_id = payload.get("sub")
-    if user_id is None:
-        raise credentials_exception
-    
+    # "sub" is the user id as a string; convert once for a primary-key lookup
     try:
-        # Check if user_id is string or int and handle accordingly if needed
-        # In this case SQLite handles string/int conversion automatically usually but explicit casting is safer
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-    except Exception:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
         raise credentials_exception
+    
+    user = db.get(models.User, user_id)
         
     if user is None:
         raise credentials_exception
@@ -107,6 +196,12 @@ async def get_current_active_user(
 
 def require_role(allowed_roles: list):
     """Dependency to require specific roles"""
+    return _role_checker(frozenset(allowed_roles))
+
+
+@functools.lru_cache(maxsize=32)
+def _role_checker(allowed_roles: frozenset):
+    """Build (once per role set) the dependency behind require_role"""
     async def role_checker(
         current_user: models.User = Depends(get_current_user)
     ) -> models.User:
@@ -121,7 +216,7 @@ def require_role(allowed_roles: list):
 
 def require_admin(current_user: models.User = Depends(get_current_user)) -> models.User:
     """Require admin role"""
-    if current_user.role != models.UserRole.ADMIN:
+    if current_user.role not in ADMIN_ROLES:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
@@ -131,7 +226,7 @@ def require_admin(current_user: models.User = Depends(get_current_user)) -> mode
 
 def require_manager_or_admin(current_user: models.User = Depends(get_current_user)) -> models.User:
     """Require manager or admin role"""
-    if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
+    if current_user.role not in MANAGER_OR_ADMIN_ROLES:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Manager or Admin access required"
@@ -0,0 +1,74 @@
+"""
+In-process caching for ERP System
+Thread-safe TTL cache shared by API requests and agent threads
+"""
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded dict cache whose entries expire after a time-to-live.
+    Expired entries are dropped first when full, then the oldest ones.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = {}  # key -> (expires_at, value), in insertion order
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Cache a value for ttl seconds (the cache default when omitted)"""
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.maxsize:
+                self._evict(now)
+            self._entries[key] = (expires_at, value)
+    
+    def get_or_set(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Return the cached value, calling loader and caching its result on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # Loaded outside the lock; concurrent misses may both load, last one wins
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry, returning its value"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def _evict(self, now: float):
+        """Make room for one entry; caller holds the lock"""
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        
+        while len(self._entries) >= self.maxsize:
+            del self._entries[next(iter(self._entries))]
@@ -1,18 +1,45 @@
 """
 Database configuration for ERP System
-SQLite with SQLAlchemy ORM
+SQLite by default; DATABASE_URL can point at another server (e.g. Postgres via PgBouncer)
 """
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./erp_database.db"
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./erp_database.db")
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+# Request threads and the agent scheduler share the pool; the SQLAlchemy
+# default of 5 + 10 overflow makes requests queue behind each other
+POOL_SIZE = int(os.environ.get("POOL_SIZE", "20"))
+MAX_OVERFLOW = int(os.environ.get("MAX_OVERFLOW", "10"))
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
+    # SQLite connections are shared across request and scheduler threads
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_recycle=3600,
+    pool_pre_ping=True  # Replace connections that died while idle instead of failing the request
 )
 
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection for concurrent reads alongside agent writes"""
+    if not IS_SQLITE:
+        return
+    
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")  # Readers don't block on the writer
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, fewer fsyncs per commit
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -2,93 +2,190 @@
 ERP-Grade Agentic AI Task & Workflow Management System
 FastAPI Backend Entry Point
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
-from typing import List
+import os
+import re
+import anyio
+import orjson
+from typing import List, Optional
 
 from database import engine, Base, SessionLocal
 from routers import users, tasks, notifications, audit
 from scheduler import setup_scheduler, shutdown_scheduler, get_scheduler_status, run_agent_manually
 import models
-from auth import get_password_hash
+from auth import get_password_hash, decode_token, MANAGER_OR_ADMIN_ROLES
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Threads for sync endpoints and dependencies (AnyIO defaults to 40)
+THREADPOOL_SIZE = 100
+
+# permessage-deflate for WebSocket frames (on by default, like uvicorn's own default);
+# set WS_PER_MESSAGE_DEFLATE=0 to trade bandwidth for server CPU with many clients
+WS_PER_MESSAGE_DEFLATE = os.environ.get("WS_PER_MESSAGE_DEFLATE", "1") != "0"
+
 
 from websocket_manager import manager
-from sqlalchemy import event
-import json
-from datetime import datetime
+from sqlalchemy import bindparam, event, inspect, insert, select, text, update
+from sqlalchemy.orm import Session, object_session
+
+
+def upgrade_database():
+    """Add columns and indexes introduced after an existing database was created"""
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    logger.info(f"Added column {table.name}.{column.name}")
+            
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        
+        if models.Notification.__tablename__ in existing_tables:
+            backfill_reminder_hours(conn)
+
+# Reminder tier in the message of reminders created before reminder_hours_before existed
+LEGACY_REMINDER_HOURS = re.compile(r"is due in (\d+) hours?!")
+
+def backfill_reminder_hours(conn):
+    """
+    Recover the tier of legacy reminders from their message, so the notification
+    agent's (task_id, reminder_hours_before) dedup does not remind them again
+    """
+    legacy = conn.execute(
+        select(models.Notification.id, models.Notification.message).where(
+            models.Notification.type == "reminder",
+            models.Notification.reminder_hours_before.is_(None)
+        )
+    ).all()
+    
+    backfill = []
+    for notification_id, message in legacy:
+        match = LEGACY_REMINDER_HOURS.search(message or "")
+        if match:
+            backfill.append({"notification_id": notification_id, "hours": int(match.group(1))})
+    
+    if backfill:
+        conn.execute(
+            update(models.Notification)
+            .where(models.Notification.id == bindparam("notification_id"))
+            .values(reminder_hours_before=bindparam("hours")),
+            backfill
+        )
+        logger.info(f"Backfilled reminder_hours_before for {len(backfill)} reminders")
 
 
 def init_database():
     """Initialize database and create default users"""
     Base.metadata.create_all(bind=engine)
+    upgrade_database()
     
-    db = SessionLocal()
-    try:
-        # Check if admin exists
-        admin = db.query(models.User).filter(models.User.email == "admin@erp.com").first()
-        if not admin:
-            # Create default admin user
-            admin = models.User(
-                email="admin@erp.com",
-                password_hash=get_password_hash("admin123"),
-                name="System Admin",
-                role=models.UserRole.ADMIN
-            )
-            db.add(admin)
-            
-            # Create default manager
-            manager_user = models.User(
-                email="manager@erp.com",
-                password_hash=get_password_hash("manager123"),
-                name="Project Manager",
-                role=models.UserRole.MANAGER
-            )
-            db.add(manager_user)
-            
-            # Create default user
-            user = models.User(
-                email="user@erp.com",
-                password_hash=get_password_hash("user123"),
-                name="John Developer",
-                role=models.UserRole.USER
-            )
-            db.add(user)
-            
-            db.commit()
-            logger.info("Default users created successfully")
-            
-            # Create initial agent status records
-            agents = ["PlanningAgent", "EscalationAgent", "NotificationAgent", "RiskAgent"]
-            for agent_name in agents:
-                agent = models.AgentStatus(
-                    agent_name=agent_name,
-                    status="running"
-                )
-                db.add(agent)
-            db.commit()
-            logger.info("Agent status records initialized")
-            
-    finally:
-        db.close()
+    with engine.begin() as conn:
+        # Seed only a fresh database (password hashing is deliberately slow)
+        admin = conn.execute(
+            select(models.User.id).where(models.User.email == "admin@erp.com")
+        ).first()
+        if admin:
+            return
+        
+        # Create default admin, manager and user in one multi-row INSERT
+        conn.execute(insert(models.User), [
+            {
+                "email": "admin@erp.com",
+                "password_hash": get_password_hash("admin123"),
+                "name": "System Admin",
+                "role": models.UserRole.ADMIN
+            },
+            {
+                "email": "manager@erp.com",
+                "password_hash": get_password_hash("manager123"),
+                "name": "Project Manager",
+                "role": models.UserRole.MANAGER
+            },
+            {
+                "email": "user@erp.com",
+                "password_hash": get_password_hash("user123"),
+                "name": "John Developer",
+                "role": models.UserRole.USER
+            }
+        ])
+        logger.info("Default users created successfully")
+        
+        # Create initial agent status records
+        agents = ["PlanningAgent", "EscalationAgent", "NotificationAgent", "RiskAgent"]
+        conn.execute(insert(models.AgentStatus), [
+            {"agent_name": agent_name, "status": "running"} for agent_name in agents
+        ])
+        logger.info("Agent status records initialized")
+
+def queue_broadcast(target, topic: str, message: dict):
+    """Hold a message about target's row for topic's subscribers until its session commits"""
+    session = object_session(target)
+    if session is None:
+        manager.publish_sync(topic, message)
+        return
+    manager.publish_after_commit(session, topic, message)
+
+
+@event.listens_for(Session, 'after_flush')
+def note_stale_stats(session, flush_context):
+    """Remember which cached stats the flushed tasks and notifications affect"""
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, models.Task):
+            session.info["stale_task_stats"] = True
+        elif isinstance(obj, models.Notification):
+            session.info.setdefault("stale_notification_users", set()).add(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def send_committed_broadcasts(session):
+    """Broadcast the changes that were just committed"""
+    if session.info.pop("stale_task_stats", False):
+        tasks.stats_cache.clear()
+    for user_id in session.info.pop("stale_notification_users", ()):
+        notifications.forget_user_stats(user_id)
+    
+    for topic, message in session.info.pop("ws_outbox", []):
+        manager.publish_sync(topic, message)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_rolled_back_broadcasts(session):
+    """Rolled-back rows were never visible, so never announce them"""
+    session.info.pop("ws_outbox", None)
+    session.info.pop("stale_task_stats", None)
+    session.info.pop("stale_notification_users", None)
 
 # SQLAlchemy event listener for real-time audit logs
 @event.listens_for(models.AuditLog, 'after_insert')
 def audit_log_after_insert(mapper, connection, target):
     """Broadcast new audit logs via WebSocket"""
-    # Create serializable dict
+    # Nothing to build when no audit page is listening
+    if not manager.has_subscribers("audit"):
+        return
+    
+    # Datetimes and enums are left as-is; the broadcaster's orjson encodes them natively
     log_data = {
         "id": target.id,
         "action": target.action,
         "details": target.details,
         "entity_type": target.entity_type,
         "entity_id": target.entity_id,
-        "timestamp": target.timestamp.isoformat() if target.timestamp else datetime.utcnow().isoformat(),
+        "timestamp": target.timestamp,  # Column default is applied before the INSERT
         "agent_involved": target.agent_involved,
         "user_id": target.user_id,
         # Note: We can't easily join user here without another session, 
@@ -96,60 +193,107 @@ def audit_log_after_insert(mapper, connection, target):
     }
     
     # Send broadcast
-    manager.broadcast_sync({
+    queue_broadcast(target, "audit", {
         "type": "AUDIT_LOG",
         "data": log_data
     })
 
+# Columns sent to clients for tasks and notifications
+TASK_FIELDS = ("title", "status", "priority", "due_date", "confidence_score", "assigned_to", "created_by")
+NOTIFICATION_FIELDS = ("type", "message", "is_read", "user_id", "task_id", "created_at")
+
+
+def changed_fields(target, fields: tuple) -> dict:
+    """New values of the given columns that changed in the current flush"""
+    state = inspect(target)
+    return {
+        field: getattr(target, field)
+        for field in fields
+        if state.attrs[field].history.has_changes()
+    }
+
+def task_topics(target) -> list:
+    """
+    Subscribed topics a task change goes to: all tasks (managers and admins), and
+    the tasks of its assignee, or of its previous assignee when it was reassigned
+    """
+    return tasks.subscribed_task_topics(target.assigned_to, *inspect(target).attrs.assigned_to.history.deleted)
+
 # SQLAlchemy event listeners for real-time task updates
 @event.listens_for(models.Task, 'after_insert')
+def task_after_insert(mapper, connection, target):
+    """Broadcast new tasks via WebSocket"""
+    topics = task_topics(target)
+    if not topics:
+        return
+    
+    task_data = {"id": target.id, **{field: getattr(target, field) for field in TASK_FIELDS}}
+    for topic in topics:
+        queue_broadcast(target, topic, {
+            "type": "TASK_UPDATE",
+            "data": task_data
+        })
+
 @event.listens_for(models.Task, 'after_update')
-def task_after_change(mapper, connection, target):
-    """Broadcast task changes via WebSocket"""
-    task_data = {
-        "id": target.id,
-        "title": target.title,
-        "status": target.status,
-        "priority": target.priority,
-        "due_date": target.due_date.isoformat(),
-        "confidence_score": target.confidence_score,
-        "assigned_to": target.assigned_to,
-        "created_by": target.created_by
-    }
-    manager.broadcast_sync({
-        "type": "TASK_UPDATE",
-        "data": task_data
-    })
+def task_after_update(mapper, connection, target):
+    """Broadcast only the changed task columns via WebSocket"""
+    topics = task_topics(target)
+    if not topics:
+        return
+    
+    # Nothing clients display changed (e.g. only updated_at was touched)
+    changes = changed_fields(target, TASK_FIELDS)
+    if not changes:
+        return
+    for topic in topics:
+        queue_broadcast(target, topic, {
+            "type": "TASK_UPDATE",
+            "data": {"id": target.id, "changes": changes}
+        })
 
 @event.listens_for(models.Task, 'after_delete')
 def task_after_delete(mapper, connection, target):
-    manager.broadcast_sync({
-        "type": "TASK_DELETE",
-        "data": {"id": target.id}
-    })
+    for topic in task_topics(target):
+        queue_broadcast(target, topic, {
+            "type": "TASK_DELETE",
+            "data": {"id": target.id}
+        })
 
 # SQLAlchemy event listeners for real-time notification updates
 @event.listens_for(models.Notification, 'after_insert')
-@event.listens_for(models.Notification, 'after_update')
-def notification_after_change(mapper, connection, target):
-    """Broadcast notification changes via WebSocket"""
-    notification_data = {
-        "id": target.id,
-        "type": target.type,
-        "message": target.message,
-        "is_read": target.is_read,
-        "user_id": target.user_id,
-        "task_id": target.task_id,
-        "created_at": target.created_at.isoformat()
-    }
-    manager.broadcast_sync({
+def notification_after_insert(mapper, connection, target):
+    """Send new notifications to their user via WebSocket"""
+    topic = notifications.notification_topic(target.user_id)
+    if not manager.has_subscribers(topic):
+        return
+    
+    notification_data = {"id": target.id, **{field: getattr(target, field) for field in NOTIFICATION_FIELDS}}
+    queue_broadcast(target, topic, {
         "type": "NOTIFICATION_UPDATE",
         "data": notification_data
     })
 
+@event.listens_for(models.Notification, 'after_update')
+def notification_after_update(mapper, connection, target):
+    """Send only the changed notification columns to their user via WebSocket"""
+    topic = notifications.notification_topic(target.user_id)
+    if not manager.has_subscribers(topic):
+        return
+    
+    changes = changed_fields(target, NOTIFICATION_FIELDS)
+    if not changes:
+        return
+    queue_broadcast(target, topic, {
+        "type": "NOTIFICATION_UPDATE",
+        "data": {"id": target.id, "changes": changes}
+    })
+
 @event.listens_for(models.Notification, 'after_delete')
 def notification_after_delete(mapper, connection, target):
-    manager.broadcast_sync({
+    topic = notifications.notification_topic(target.user_id)
+    if not manager.has_subscribers(topic):
+        return
+    queue_broadcast(target, topic, {
         "type": "NOTIFICATION_DELETE",
         "data": {"id": target.id}
     })
@@ -160,6 +304,8 @@ async def lifespan(app: FastAPI):
     """Application lifecycle management"""
     # Startup
     logger.info("Starting ERP Agentic AI System...")
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    manager.start()
     init_database()
     setup_scheduler()
     logger.info("System ready!")
@@ -169,6 +315,7 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down...")
     shutdown_scheduler()
+    await manager.stop()
 
 
 # Create FastAPI app
@@ -226,23 +373,89 @@ async def scheduler_status():
 
 @app.post("/api/scheduler/run/{agent_name}")
 async def run_agent(agent_name: str):
-    """Manually trigger an agent run"""
-    success = run_agent_manually(agent_name)
+    """Manually trigger an agent run ("all" runs every agent)"""
+    # Agents do blocking DB work, so run them off the event loop
+    success = await asyncio.to_thread(run_agent_manually, agent_name)
     if success:
+        # Agent runs write audit logs; don't serve a summary from before the run
+        audit.summary_cache.clear()
         return {"message": f"Agent {agent_name} executed successfully"}
     return {"error": f"Unknown agent: {agent_name}"}
 
 
+def subscription_request(data: str) -> Optional[dict]:
+    """A {"type": "subscribe", "topics": [...], "token": ...} frame, or None for any other frame"""
+    try:
+        request = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return None
+    if isinstance(request, dict) and request.get("type") == "subscribe":
+        return request
+    return None
+
+
+def allowed_topics(token, asked: List[str]) -> Optional[List[str]]:
+    """
+    The topics the token's user may receive out of those asked for ("tasks", "audit",
+    "notifications"), or None for an invalid token or inactive user. Follows the REST
+    rules: the audit stream is for managers and admins, and users only get the tasks
+    assigned to them and their own notifications
+    """
+    payload = decode_token(token) if isinstance(token, str) else None
+    if payload is None:
+        return None
+    try:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+    
+    # Looked up rather than read from the token, so role changes and deactivation apply
+    db = SessionLocal()
+    try:
+        user = db.get(models.User, user_id)
+    finally:
+        db.close()
+    if user is None or not user.is_active:
+        return None
+    
+    is_manager = user.role in MANAGER_OR_ADMIN_ROLES
+    topics = []
+    if "tasks" in asked:
+        topics.append("tasks" if is_manager else tasks.task_topic(user.id))
+    if "audit" in asked and is_manager:
+        topics.append("audit")
+    if "notifications" in asked:
+        topics.append(notifications.notification_topic(user.id))
+    return topics
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket for real-time updates"""
+    """WebSocket for real-time updates; clients receive the topics they subscribe to"""
     await manager.connect(websocket)
     try:
-        while True:
-            data = await websocket.receive_text()
-            # Echo back for now - can extend for bidirectional communication
-            await websocket.send_json({"type": "echo", "data": data})
-    except WebSocketDisconnect:
+        # Ends when the client disconnects
+        async for data in websocket.iter_text():
+            request = subscription_request(data)
+            if request is None:
+                # Echo back for now - can extend for bidirectional communication
+                manager.send(websocket, {"type": "echo", "data": data})
+                continue
+            
+            asked = request.get("topics")
+            if not isinstance(asked, list) or not all(isinstance(topic, str) for topic in asked):
+                manager.send(websocket, {"type": "error", "data": "topics must be a list of strings"})
+                continue
+            
+            # Blocking user lookup, so off the event loop
+            topics = await asyncio.to_thread(allowed_topics, request.get("token"), asked)
+            if topics is None:
+                manager.send(websocket, {"type": "error", "data": "Could not validate credentials"})
+                continue
+            for topic in topics:
+                manager.subscribe(websocket, topic)
+            manager.send(websocket, {"type": "subscribed", "data": topics})
+    finally:
         manager.disconnect(websocket)
 
 
@@ -255,4 +468,4 @@ async def broadcast_message(message: dict):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
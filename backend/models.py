@@ -1,7 +1,7 @@
 """
 SQLAlchemy Models for ERP System
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, Enum, Table
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, Enum, Table, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -70,6 +70,10 @@ class User(Base):
     audit_logs = relationship("AuditLog", back_populates="user")
 
 
+# Columns UserResponse serializes; lists and joined users load only these (no password hash)
+USER_RESPONSE_COLUMNS = (User.id, User.email, User.name, User.role, User.is_active, User.created_at)
+
+
 class Task(Base):
     __tablename__ = "tasks"
     
@@ -106,6 +110,25 @@ class Task(Base):
         secondaryjoin=id == task_dependencies.c.dependency_id,
         backref="dependent_tasks"
     )
+    
+    __table_args__ = (
+        # Agent scans filter on escalation flag + status, then due date
+        Index("ix_tasks_agent_scan", "is_escalated", "status", "due_date"),
+        # Dashboard / overdue / high-risk lists filter on status, then due date
+        Index("ix_tasks_status_due", "status", "due_date"),
+        # Partial indexes covering only the open and the high-risk tasks, which the
+        # overdue and high-risk lists and counts scan (enums are stored by name)
+        Index(
+            "ix_tasks_open_due", "due_date",
+            sqlite_where=text("status != 'COMPLETED'"),
+            postgresql_where=text("status != 'COMPLETED'")
+        ),
+        Index(
+            "ix_tasks_high_risk", "confidence_score",
+            sqlite_where=text("confidence_score < 40"),
+            postgresql_where=text("confidence_score < 40")
+        ),
+    )
 
 
 class Notification(Base):
@@ -119,8 +142,10 @@ class Notification(Base):
     retry_count = Column(Integer, default=0)
     max_retries = Column(Integer, default=3)
     is_read = Column(Boolean, default=False)
+    read_at = Column(DateTime, nullable=True)
     scheduled_at = Column(DateTime, nullable=True)
     sent_at = Column(DateTime, nullable=True)
+    reminder_hours_before = Column(Integer, index=True, nullable=True)  # Set on reminder notifications
     
     # Foreign Keys
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -132,6 +157,15 @@ class Notification(Base):
     # Relationships
     user = relationship("User", back_populates="notifications")
     task = relationship("Task", back_populates="notifications")
+    
+    __table_args__ = (
+        # NotificationAgent picks up pending notifications that are due
+        Index("ix_notifications_pending", "status", "scheduled_at"),
+        # Per-user unread counts
+        Index("ix_notifications_user_read", "user_id", "is_read"),
+        # Per-user inbox, newest (highest id) first, paged by id (scanned backwards)
+        Index("ix_notifications_user_id", "user_id", "id"),
+    )
 
 
 class AuditLog(Base):
@@ -152,6 +186,15 @@ class AuditLog(Base):
     
     # Relationships
     user = relationship("User", back_populates="audit_logs")
+    
+    # Audit queries take a recent time window, optionally narrowed by one column,
+    # and list newest first; each index serves both the range and the ordering
+    __table_args__ = (
+        Index("ix_audit_logs_timestamp", "timestamp"),
+        Index("ix_audit_logs_user_ts", "user_id", "timestamp"),
+        Index("ix_audit_logs_entity_ts", "entity_type", "timestamp"),
+        Index("ix_audit_logs_agent_ts", "agent_involved", "timestamp"),
+    )
 
 
 class AgentStatus(Base):
@@ -2,32 +2,57 @@
 Audit Logs Router - Audit Log Management
 """
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session, selectinload
 from typing import List, Optional
 from datetime import datetime, timedelta
 
 from database import get_db
+from cache import TTLCache
 import models
 import schemas
 from auth import get_current_user, require_manager_or_admin
 
 router = APIRouter(prefix="/api/audit", tags=["Audit Logs"])
 
+# Summaries by period (days); dashboards poll this far more often than it changes
+summary_cache = TTLCache(maxsize=32, ttl=30)
 
-@router.get("/", response_model=List[schemas.AuditLogResponse])
-async def get_audit_logs(
+# Load the users of a page of logs in one IN query, with only the fields UserResponse needs
+audit_log_user = selectinload(models.AuditLog.user).load_only(*models.USER_RESPONSE_COLUMNS)
+
+
+def paginate_audit_logs(query, before_ts: Optional[datetime], before_id: Optional[int], limit: int) -> dict:
+    """Newest-first keyset page of logs before the (before_ts, before_id) cursor, with the cursor for the next page"""
+    if before_ts is not None:
+        # Logs can share a timestamp, so the id orders them within one
+        older = models.AuditLog.timestamp < before_ts
+        if before_id is not None:
+            older = or_(older, and_(models.AuditLog.timestamp == before_ts, models.AuditLog.id < before_id))
+        query = query.filter(older)
+    
+    items = query.order_by(models.AuditLog.timestamp.desc(), models.AuditLog.id.desc()).limit(limit).all()
+    
+    # A short page means there is nothing older left to fetch
+    if len(items) < limit:
+        return {"items": items, "next_cursor": None, "next_cursor_id": None}
+    return {"items": items, "next_cursor": items[-1].timestamp, "next_cursor_id": items[-1].id}
+
+
+@router.get("/", response_model=schemas.AuditLogPage)
+def get_audit_logs(
     action: Optional[str] = None,
     entity_type: Optional[str] = None,
     user_id: Optional[int] = None,
     days: int = Query(default=7, ge=1, le=90),
     limit: int = Query(default=100, ge=1, le=500),
+    before_ts: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get audit logs with filters (Manager/Admin only)"""
-    query = db.query(models.AuditLog).options(
-        joinedload(models.AuditLog.user)
-    )
+    query = db.query(models.AuditLog).options(audit_log_user)
     
     # Filter by date range
     start_date = datetime.utcnow() - timedelta(days=days)
@@ -40,35 +65,41 @@ async def get_audit_logs(
     if user_id:
         query = query.filter(models.AuditLog.user_id == user_id)
     
-    return query.order_by(models.AuditLog.timestamp.desc()).limit(limit).all()
+    return paginate_audit_logs(query, before_ts, before_id, limit)
 
 
-@router.get("/my-activity", response_model=List[schemas.AuditLogResponse])
-async def get_my_activity(
+@router.get("/my-activity", response_model=schemas.AuditLogPage)
+def get_my_activity(
     days: int = Query(default=7, ge=1, le=30),
+    before_ts: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get current user's activity log"""
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    return db.query(models.AuditLog).filter(
+    query = db.query(models.AuditLog).options(audit_log_user).filter(
         models.AuditLog.user_id == current_user.id,
         models.AuditLog.timestamp >= start_date
-    ).order_by(models.AuditLog.timestamp.desc()).limit(50).all()
+    )
+    
+    return paginate_audit_logs(query, before_ts, before_id, 50)
 
 
-@router.get("/agent-actions", response_model=List[schemas.AuditLogResponse])
-async def get_agent_actions(
+@router.get("/agent-actions", response_model=schemas.AuditLogPage)
+def get_agent_actions(
     agent_name: Optional[str] = None,
     days: int = Query(default=7, ge=1, le=30),
+    before_ts: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get AI agent actions (Manager/Admin only)"""
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    query = db.query(models.AuditLog).filter(
+    query = db.query(models.AuditLog).options(audit_log_user).filter(
         models.AuditLog.agent_involved.isnot(None),
         models.AuditLog.timestamp >= start_date
     )
@@ -76,49 +107,54 @@ async def get_agent_actions(
     if agent_name:
         query = query.filter(models.AuditLog.agent_involved == agent_name)
     
-    return query.order_by(models.AuditLog.timestamp.desc()).limit(100).all()
+    return paginate_audit_logs(query, before_ts, before_id, 100)
 
 
 @router.get("/summary")
-async def get_audit_summary(
+def get_audit_summary(
     days: int = Query(default=7, ge=1, le=30),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get audit log summary (Manager/Admin only)"""
+    summary = summary_cache.get(days)
+    if summary is not None:
+        return summary
+    
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    logs = db.query(models.AuditLog).filter(
-        models.AuditLog.timestamp >= start_date
-    ).all()
+    in_period = models.AuditLog.timestamp >= start_date
     
     # Count by action
-    actions = {}
-    for log in logs:
-        actions[log.action] = actions.get(log.action, 0) + 1
+    actions = dict(db.query(models.AuditLog.action, func.count()).filter(
+        in_period
+    ).group_by(models.AuditLog.action).all())
     
     # Count by entity type
-    entities = {}
-    for log in logs:
-        entities[log.entity_type] = entities.get(log.entity_type, 0) + 1
+    entities = dict(db.query(models.AuditLog.entity_type, func.count()).filter(
+        in_period
+    ).group_by(models.AuditLog.entity_type).all())
     
     # Count agent actions
-    agent_actions = 0
-    for log in logs:
-        if log.agent_involved:
-            agent_actions += 1
+    agent_actions = db.query(func.count(models.AuditLog.id)).filter(
+        in_period,
+        models.AuditLog.agent_involved.isnot(None),
+        models.AuditLog.agent_involved != ""
+    ).scalar()
     
-    return {
-        "total_actions": len(logs),
+    summary = {
+        "total_actions": sum(actions.values()),
         "by_action": actions,
         "by_entity": entities,
         "agent_actions": agent_actions,
         "period_days": days
     }
+    summary_cache.set(days, summary)
+    return summary
 
 
 @router.get("/agents/status", response_model=List[schemas.AgentStatusResponse])
-async def get_agent_status(
+def get_agent_status(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
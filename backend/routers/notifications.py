@@ -1,26 +1,38 @@
 """
 Notifications Router - Notification Management
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import case, func, insert, update
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
 from database import get_db
+from cache import TTLCache
 import models
 import schemas
 from auth import get_current_user
+from websocket_manager import manager
 
 router = APIRouter(prefix="/api/notifications", tags=["Notifications"])
 
-# Import manager from main (circular import handling)
-# To avoid circular imports, we'll try to import manager inside the function or assume it's passed/available
-# Ideally, manager should be in a separate file, but for now we'll write to DB and rely on periodic polling or client refresh
-# The main.py has the manager instance.
+# Per-user unread counts and stats, polled by the header badge
+stats_cache = TTLCache(maxsize=4096, ttl=30)
+
+
+def notification_topic(user_id) -> str:
+    """WebSocket topic carrying one user's notification changes"""
+    return f"notifications:{user_id}"
+
+
+def forget_user_stats(user_id: int):
+    """Drop a user's cached notification counts after their notifications change"""
+    stats_cache.pop(("unread_count", user_id))
+    stats_cache.pop(("stats", user_id))
 
 
 @router.post("/send-to-all")
-async def send_to_all(
+def send_to_all(
     data: schemas.NotificationBroadcast,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -30,101 +42,154 @@ async def send_to_all(
     # if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
     #     raise HTTPException(status_code=403, detail="Not authorized to broadcast messages")
         
-    users = []
     if data.recipient_email:
         # Send to specific user
-        user = db.query(models.User).filter(models.User.email == data.recipient_email).first()
-        if not user:
+        user_id = db.query(models.User.id).filter(models.User.email == data.recipient_email).scalar()
+        if user_id is None:
             raise HTTPException(status_code=404, detail=f"User with email {data.recipient_email} not found")
-        users = [user]
+        user_ids = [user_id]
     else:
         # Send to all users
-        users = db.query(models.User).filter(models.User.is_active == True).all()
+        user_ids = [user_id for (user_id,) in db.query(models.User.id).filter(models.User.is_active == True)]
+    
+    message = f"{data.message}\n\nFrom: {current_user.name} ({current_user.email})"
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            "user_id": user_id,
+            "type": data.type,
+            "message": message,
+            "channel": data.channel,
+            "status": models.NotificationStatus.PENDING,
+            "created_at": created_at
+        }
+        for user_id in user_ids
+    ]
+    
+    # One bulk INSERT (SQLAlchemy pages very large batches itself); the RETURNING
+    # ids come back in the order of rows
+    notification_ids = db.scalars(
+        insert(models.Notification).returning(models.Notification.id, sort_by_parameter_order=True),
+        rows
+    ).all() if rows else []
+    
+    # Bulk inserts skip the ORM listeners, so announce the new rows to their users here
+    for notification_id, row in zip(notification_ids, rows):
+        topic = notification_topic(row["user_id"])
+        if manager.has_subscribers(topic):
+            manager.publish_after_commit(db, topic, {
+                "type": "NOTIFICATION_UPDATE",
+                "data": {
+                    "id": notification_id,
+                    "type": row["type"],
+                    "message": message,
+                    "is_read": False,
+                    "user_id": row["user_id"],
+                    "task_id": None,
+                    "created_at": created_at
+                }
+            })
     
-    count = 0
-    for user in users:
-        notification = models.Notification(
-            user_id=user.id,
-            type=data.type,
-            message=f"{data.message}\n\nFrom: {current_user.name} ({current_user.email})",
-            channel=data.channel,
-            status=models.NotificationStatus.PENDING
-        )
-        db.add(notification)
-        count += 1
-        
     db.commit()
+    stats_cache.clear()
+    count = len(rows)
     
     target_msg = f"user {data.recipient_email}" if data.recipient_email else f"{count} users"
     return {"message": f"Message sent to {target_msg}"}
 
 
 @router.get("/", response_model=List[schemas.NotificationResponse])
-async def get_notifications(
+def get_notifications(
     unread_only: bool = False,
+    limit: int = Query(default=50, ge=1, le=200),
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """Get notifications for current user"""
+    """Get notifications for current user, newest first; pass the last id seen as before_id for the next page"""
     query = db.query(models.Notification).filter(
         models.Notification.user_id == current_user.id
     )
     
     if unread_only:
         query = query.filter(models.Notification.is_read == False)
+    if before_id is not None:
+        query = query.filter(models.Notification.id < before_id)
     
-    return query.order_by(models.Notification.created_at.desc()).limit(50).all()
+    # Ordered by id alone to match the before_id cursor; created_at can disagree
+    # with insert order (send-to-all stamps it up front, agents insert concurrently)
+    return query.order_by(models.Notification.id.desc()).limit(limit).all()
 
 
 @router.get("/unread-count")
-async def get_unread_count(
+def get_unread_count(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get count of unread notifications"""
-    count = db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id,
-        models.Notification.is_read == False
-    ).count()
+    count = stats_cache.get_or_set(
+        ("unread_count", current_user.id),
+        lambda: db.query(models.Notification).filter(
+            models.Notification.user_id == current_user.id,
+            models.Notification.is_read == False
+        ).count()
+    )
     
     return {"unread_count": count}
 
 
 @router.post("/mark-read")
-async def mark_notifications_read(
+def mark_notifications_read(
     data: schemas.NotificationMarkRead,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Mark notifications as read"""
-    db.query(models.Notification).filter(
-        models.Notification.id.in_(data.notification_ids),
-        models.Notification.user_id == current_user.id
-    ).update({models.Notification.is_read: True}, synchronize_session=False)
-    
-    db.commit()
+    count = mark_read(db, current_user.id, models.Notification.id.in_(data.notification_ids))
     
-    return {"message": "Notifications marked as read"}
+    return {"message": "Notifications marked as read", "count": count}
 
 
 @router.post("/mark-all-read")
-async def mark_all_notifications_read(
+def mark_all_notifications_read(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Mark all notifications as read"""
-    db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id,
-        models.Notification.is_read == False
-    ).update({models.Notification.is_read: True}, synchronize_session=False)
+    count = mark_read(db, current_user.id)
     
-    db.commit()
+    return {"message": "All notifications marked as read", "count": count}
+
+
+def mark_read(db: Session, user_id: int, *criteria) -> int:
+    """
+    Mark a user's unread notifications matching criteria as read, stamping read_at.
+    Returns how many changed; when none did, nothing is committed.
+    """
+    read_ids = db.scalars(
+        update(models.Notification).where(
+            models.Notification.user_id == user_id,
+            models.Notification.is_read == False,
+            *criteria
+        ).values(is_read=True, read_at=func.now()).returning(models.Notification.id)
+    ).all()
     
-    return {"message": "All notifications marked as read"}
+    if read_ids:
+        # The bulk UPDATE skips the ORM listeners, so announce the reads here
+        topic = notification_topic(user_id)
+        if manager.has_subscribers(topic):
+            for notification_id in read_ids:
+                manager.publish_after_commit(db, topic, {
+                    "type": "NOTIFICATION_UPDATE",
+                    "data": {"id": notification_id, "changes": {"is_read": True}}
+                })
+        db.commit()
+        forget_user_stats(user_id)
+    return len(read_ids)
 
 
 @router.delete("/{notification_id}")
-async def delete_notification(
+def delete_notification(
     notification_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -145,28 +210,27 @@ async def delete_notification(
 
 
 @router.get("/stats")
-async def get_notification_stats(
+def get_notification_stats(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get notification statistics"""
-    total = db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id
-    ).count()
-    
-    unread = db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id,
-        models.Notification.is_read == False
-    ).count()
-    
-    by_type = {}
-    for notification in db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id
-    ).all():
-        by_type[notification.type] = by_type.get(notification.type, 0) + 1
+    return stats_cache.get_or_set(("stats", current_user.id), lambda: notification_stats(db, current_user.id))
+
+
+def notification_stats(db: Session, user_id: int) -> dict:
+    """Total, unread and per-type notification counts for one user"""
+    # Total and unread counts per type in one aggregate query
+    rows = db.query(
+        models.Notification.type,
+        func.count(models.Notification.id).label("total"),
+        func.sum(case((models.Notification.is_read == False, 1), else_=0)).label("unread")
+    ).filter(
+        models.Notification.user_id == user_id
+    ).group_by(models.Notification.type).all()
     
     return {
-        "total": total,
-        "unread": unread,
-        "by_type": by_type
+        "total": sum(row.total for row in rows),
+        "unread": sum(row.unread for row in rows),
+        "by_type": {row.type: row.total for row in rows}
     }
@@ -1,22 +1,70 @@
 """
 Tasks Router - Task CRUD and Management
 """
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session, joinedload, noload, raiseload, selectinload
+from sqlalchemy import and_, case, func
+from typing import List, Literal, Optional
 from datetime import datetime, timedelta
 
 from database import get_db
+from cache import TTLCache
 import models
 import schemas
 from auth import get_current_user, require_manager_or_admin
+from websocket_manager import manager
 
 router = APIRouter(prefix="/api/tasks", tags=["Tasks"])
 
+# Dashboard aggregates, polled by every open dashboard; main.py clears this
+# whenever a committed transaction touched tasks
+stats_cache = TTLCache(maxsize=1024, ttl=15)
+
+
+def task_topic(user_id) -> str:
+    """WebSocket topic carrying changes to the tasks assigned to one user"""
+    return f"tasks:{user_id}"
+
+def subscribed_task_topics(*assignees) -> list:
+    """
+    Subscribed topics a task change goes to: all tasks (managers and admins), and
+    the tasks of each given assignee
+    """
+    topics = ["tasks"] + [task_topic(user_id) for user_id in dict.fromkeys(assignees) if user_id is not None]
+    return [topic for topic in topics if manager.has_subscribers(topic)]
+
+# Relations serialized for a task shown as a row (e.g. a dependency of another task):
+# its users but not its own dependencies; any other relation raises instead of
+# quietly lazy loading once per row
+task_row_options = (
+    joinedload(models.Task.assignee).load_only(*models.USER_RESPONSE_COLUMNS),
+    joinedload(models.Task.creator).load_only(*models.USER_RESPONSE_COLUMNS),
+    noload(models.Task.dependencies),
+    raiseload("*")
+)
+
+# Relations list endpoints include only when asked, e.g. ?expand_fields=assignee
+ExpandField = Literal["assignee", "creator", "dependencies"]
+
+
+def task_list_options(expand_fields: List[str]) -> list:
+    """Load the requested relations of listed tasks and leave the rest empty"""
+    options = [
+        joinedload(relation).load_only(*models.USER_RESPONSE_COLUMNS) if name in expand_fields else noload(relation)
+        for name, relation in (("assignee", models.Task.assignee), ("creator", models.Task.creator))
+    ]
+    
+    if "dependencies" in expand_fields:
+        options.append(selectinload(models.Task.dependencies).options(*task_row_options))
+    else:
+        options.append(noload(models.Task.dependencies))
+    
+    options.append(raiseload("*"))
+    return options
+
 
 @router.post("/", response_model=schemas.TaskResponse)
-async def create_task(
+def create_task(
     task_data: schemas.TaskCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -47,10 +95,9 @@ async def create_task(
         task.dependencies = dependencies
     
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    db.flush()  # Assigns task.id for the audit log
     
-    # Log the creation
+    # Log the creation in the same transaction as the task
     audit_log = models.AuditLog(
         action="task_created",
         entity_type="task",
@@ -65,17 +112,15 @@ async def create_task(
 
 
 @router.get("/", response_model=List[schemas.TaskResponse])
-async def get_all_tasks(
+def get_all_tasks(
     status_filter: Optional[str] = None,
     priority_filter: Optional[str] = None,
+    expand_fields: List[ExpandField] = Query(default=[]),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get all tasks with optional filters"""
-    query = db.query(models.Task).options(
-        joinedload(models.Task.assignee),
-        joinedload(models.Task.creator)
-    )
+    query = db.query(models.Task).options(*task_list_options(expand_fields))
     
     # Regular users only see their tasks
     if current_user.role == models.UserRole.USER:
@@ -90,91 +135,111 @@ async def get_all_tasks(
 
 
 @router.get("/my-tasks", response_model=List[schemas.TaskResponse])
-async def get_my_tasks(
+def get_my_tasks(
+    expand_fields: List[ExpandField] = Query(default=[]),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get tasks assigned to current user"""
-    return db.query(models.Task).options(
-        joinedload(models.Task.assignee),
-        joinedload(models.Task.creator)
-    ).filter(
+    return db.query(models.Task).options(*task_list_options(expand_fields)).filter(
         models.Task.assigned_to == current_user.id
     ).order_by(models.Task.due_date.asc()).all()
 
 
 @router.get("/dashboard-stats", response_model=schemas.DashboardStats)
-async def get_dashboard_stats(
+def get_dashboard_stats(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get dashboard statistics for current user"""
+    # Users see their own tasks; managers and admins all share the same numbers
+    if current_user.role == models.UserRole.USER:
+        return stats_cache.get_or_set(
+            ("dashboard", current_user.id),
+            lambda: dashboard_stats(db, current_user.id)
+        )
+    return stats_cache.get_or_set(("dashboard", None), lambda: dashboard_stats(db, None))
+
+
+def dashboard_stats(db: Session, assigned_to: Optional[int]) -> dict:
+    """Task counts for the dashboard, limited to one assignee when given"""
     base_query = db.query(models.Task)
     
-    if current_user.role == models.UserRole.USER:
-        base_query = base_query.filter(models.Task.assigned_to == current_user.id)
+    if assigned_to is not None:
+        base_query = base_query.filter(models.Task.assigned_to == assigned_to)
     
-    total = base_query.count()
-    in_progress = base_query.filter(models.Task.status == models.TaskStatus.IN_PROGRESS).count()
-    completed = base_query.filter(models.Task.status == models.TaskStatus.COMPLETED).count()
-    overdue = base_query.filter(
-        models.Task.due_date < datetime.utcnow(),
-        models.Task.status != models.TaskStatus.COMPLETED
-    ).count()
-    high_risk = base_query.filter(models.Task.confidence_score < 40).count()
+    # All counts in one pass over the tasks (SUM is NULL when there are none)
+    stats = base_query.with_entities(
+        func.count(models.Task.id).label("total"),
+        func.coalesce(func.sum(case((models.Task.status == models.TaskStatus.IN_PROGRESS, 1), else_=0)), 0).label("in_progress"),
+        func.coalesce(func.sum(case((models.Task.status == models.TaskStatus.COMPLETED, 1), else_=0)), 0).label("completed"),
+        func.coalesce(func.sum(case((and_(
+            models.Task.due_date < datetime.utcnow(),
+            models.Task.status != models.TaskStatus.COMPLETED
+        ), 1), else_=0)), 0).label("overdue"),
+        func.coalesce(func.sum(case((models.Task.confidence_score < 40, 1), else_=0)), 0).label("high_risk")
+    ).one()
     
     return {
-        "total_tasks": total,
-        "in_progress": in_progress,
-        "completed": completed,
-        "overdue": overdue,
-        "high_risk": high_risk
+        "total_tasks": stats.total,
+        "in_progress": stats.in_progress,
+        "completed": stats.completed,
+        "overdue": stats.overdue,
+        "high_risk": stats.high_risk
     }
 
 
 @router.get("/manager-stats", response_model=schemas.ManagerStats)
-async def get_manager_stats(
+def get_manager_stats(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get manager dashboard statistics"""
-    total = db.query(models.Task).count()
+    return stats_cache.get_or_set("manager", lambda: manager_stats(db))
+
+
+def manager_stats(db: Session) -> dict:
+    """Team-wide task statistics for the manager dashboard"""
     overdue = db.query(models.Task).filter(
         models.Task.due_date < datetime.utcnow(),
         models.Task.status != models.TaskStatus.COMPLETED
     ).count()
     high_risk = db.query(models.Task).filter(models.Task.confidence_score < 40).count()
     
-    # Tasks per user
-    tasks_per_user = {}
-    users = db.query(models.User).filter(models.User.role == models.UserRole.USER).all()
-    overloaded_count = 0
-    
-    for user in users:
-        task_count = db.query(models.Task).filter(
-            models.Task.assigned_to == user.id,
+    # Open tasks per user (the outer join keeps users with none)
+    tasks_per_user = dict(db.query(models.User.name, func.count(models.Task.id)).outerjoin(
+        models.Task,
+        and_(
+            models.Task.assigned_to == models.User.id,
             models.Task.status != models.TaskStatus.COMPLETED
-        ).count()
-        tasks_per_user[user.name] = task_count
-        if task_count > 5:  # Overloaded threshold
-            overloaded_count += 1
+        )
+    ).filter(
+        models.User.role == models.UserRole.USER
+    ).group_by(models.User.id, models.User.name).all())
+    overloaded_count = sum(1 for task_count in tasks_per_user.values() if task_count > 5)  # Overloaded threshold
     
     # Status distribution
-    status_dist = {}
-    for status in models.TaskStatus:
-        count = db.query(models.Task).filter(models.Task.status == status).count()
-        status_dist[status.value] = count
+    status_counts = dict(db.query(models.Task.status, func.count()).group_by(models.Task.status).all())
+    status_dist = {status.value: status_counts.get(status, 0) for status in models.TaskStatus}
+    total = sum(status_dist.values())
     
     # Completion trend (last 7 days)
+    now = datetime.utcnow()
+    first_day = (now - timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
+    completed_day = func.date(models.Task.completed_at)
+    completed_by_day = {
+        str(day): count
+        for day, count in db.query(completed_day, func.count()).filter(
+            models.Task.completed_at >= first_day
+        ).group_by(completed_day).all()
+    }
+    
     trend = []
     for i in range(6, -1, -1):
-        date = datetime.utcnow() - timedelta(days=i)
-        completed = db.query(models.Task).filter(
-            func.date(models.Task.completed_at) == date.date()
-        ).count()
+        date = now - timedelta(days=i)
         trend.append({
             "date": date.strftime("%b %d"),
-            "completed": completed
+            "completed": completed_by_day.get(date.date().isoformat(), 0)
         })
     
     return {
@@ -189,43 +254,43 @@ async def get_manager_stats(
 
 
 @router.get("/high-risk", response_model=List[schemas.TaskResponse])
-async def get_high_risk_tasks(
+def get_high_risk_tasks(
+    expand_fields: List[ExpandField] = Query(default=[]),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get high-risk tasks (Manager/Admin only)"""
-    return db.query(models.Task).options(
-        joinedload(models.Task.assignee)
-    ).filter(
+    return db.query(models.Task).options(*task_list_options(expand_fields)).filter(
         models.Task.confidence_score < 40
     ).order_by(models.Task.confidence_score.asc()).all()
 
 
 @router.get("/overdue", response_model=List[schemas.TaskResponse])
-async def get_overdue_tasks(
+def get_overdue_tasks(
+    expand_fields: List[ExpandField] = Query(default=[]),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get overdue tasks (Manager/Admin only)"""
-    return db.query(models.Task).options(
-        joinedload(models.Task.assignee)
-    ).filter(
+    return db.query(models.Task).options(*task_list_options(expand_fields)).filter(
         models.Task.due_date < datetime.utcnow(),
         models.Task.status != models.TaskStatus.COMPLETED
     ).order_by(models.Task.due_date.asc()).all()
 
 
 @router.get("/{task_id}", response_model=schemas.TaskResponse)
-async def get_task(
+def get_task(
     task_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get task by ID"""
+    # Many-to-many dependencies come from one IN query rather than multiplying
+    # the joined rows; each dependency is serialized like a list row
     task = db.query(models.Task).options(
-        joinedload(models.Task.assignee),
-        joinedload(models.Task.creator),
-        joinedload(models.Task.dependencies)
+        joinedload(models.Task.assignee).load_only(*models.USER_RESPONSE_COLUMNS),
+        joinedload(models.Task.creator).load_only(*models.USER_RESPONSE_COLUMNS),
+        selectinload(models.Task.dependencies).options(*task_row_options)
     ).filter(models.Task.id == task_id).first()
     
     if not task:
@@ -239,7 +304,7 @@ async def get_task(
 
 
 @router.put("/{task_id}", response_model=schemas.TaskResponse)
-async def update_task(
+def update_task(
     task_id: int,
     task_data: schemas.TaskUpdate,
     db: Session = Depends(get_db),
@@ -254,10 +319,7 @@ async def update_task(
     for key, value in update_data.items():
         setattr(task, key, value)
     
-    db.commit()
-    db.refresh(task)
-    
-    # Log update
+    # Log update; committed together with it
     audit_log = models.AuditLog(
         action="task_updated",
         entity_type="task",
@@ -272,7 +334,7 @@ async def update_task(
 
 
 @router.patch("/{task_id}/status")
-async def update_task_status(
+def update_task_status(
     task_id: int,
     status_update: schemas.TaskStatusUpdate,
     db: Session = Depends(get_db),
@@ -289,9 +351,7 @@ async def update_task_status(
     if status_update.status == models.TaskStatus.COMPLETED:
         task.completed_at = datetime.utcnow()
     
-    db.commit()
-    
-    # Log status change
+    # Log status change; committed together with it
     audit_log = models.AuditLog(
         action="task_status_changed",
         entity_type="task",
@@ -306,7 +366,7 @@ async def update_task_status(
 
 
 @router.delete("/{task_id}")
-async def delete_task(
+def delete_task(
     task_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -322,9 +382,8 @@ async def delete_task(
     
     title = task.title
     db.delete(task)
-    db.commit()
     
-    # Log deletion
+    # Log deletion; committed together with it
     audit_log = models.AuditLog(
         action="task_deleted",
         entity_type="task",
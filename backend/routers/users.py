@@ -1,17 +1,19 @@
 """
 Users Router - Authentication and User Management
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only
 from typing import List
 from datetime import timedelta
 
 from database import get_db
+from audit_writer import queue_audit
 import models
 import schemas
 from auth import (
-    verify_password, get_password_hash, create_access_token,
+    verify_login_password, get_password_hash, password_needs_rehash, create_access_token,
+    too_many_failed_logins, record_failed_login, failed_logins,
     get_current_user, require_admin, require_manager_or_admin,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
@@ -20,37 +22,50 @@ router = APIRouter(prefix="/api/users", tags=["Users"])
 
 
 @router.post("/login", response_model=schemas.Token)
-async def login(
+def login(
     form_data: schemas.UserLogin,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """Authenticate user and return JWT token"""
+    client_ip = request.client.host if request.client else None
+    if too_many_failed_logins(form_data.email, client_ip):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts, try again later"
+        )
+    
     user = db.query(models.User).filter(models.User.email == form_data.email).first()
     
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not verify_login_password(form_data.password, user.password_hash):
+        record_failed_login(form_data.email, client_ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
+    failed_logins.pop((form_data.email, client_ip))
     
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user account")
     
+    # Upgrade legacy or outdated hashes now that we have the plain password
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = get_password_hash(form_data.password)
+        db.commit()
+    
     access_token = create_access_token(
         data={"sub": str(user.id), "role": user.role.value},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
-    # Log the login
-    audit_log = models.AuditLog(
-        action="user_login",
-        entity_type="user",
-        entity_id=user.id,
-        user_id=user.id,
-        details=f"User {user.email} logged in"
-    )
-    db.add(audit_log)
-    db.commit()
+    # Log the login off the request path; it is written with the next batch
+    queue_audit({
+        "action": "user_login",
+        "entity_type": "user",
+        "entity_id": user.id,
+        "user_id": user.id,
+        "details": f"User {user.email} logged in"
+    })
     
     return {
         "access_token": access_token,
@@ -60,13 +75,13 @@ async def login(
 
 
 @router.post("/register", response_model=schemas.UserResponse)
-async def register(
+def register(
     user_data: schemas.UserCreate,
     db: Session = Depends(get_db)
 ):
     """Register a new user"""
     # Check if email exists
-    existing = db.query(models.User).filter(models.User.email == user_data.email).first()
+    existing = db.query(models.User.id).filter(models.User.email == user_data.email).first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -78,10 +93,9 @@ async def register(
         role=user_data.role
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    db.flush()  # Assigns user.id for the audit log
     
-    # Log the registration
+    # Log the registration in the same transaction as the user
     audit_log = models.AuditLog(
         action="user_registered",
         entity_type="user",
@@ -104,16 +118,16 @@ async def get_current_user_info(
 
 
 @router.get("/", response_model=List[schemas.UserResponse])
-async def get_all_users(
+def get_all_users(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_manager_or_admin)
 ):
     """Get all users (Manager/Admin only)"""
-    return db.query(models.User).all()
+    return db.query(models.User).options(load_only(*models.USER_RESPONSE_COLUMNS)).all()
 
 
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-async def get_user(
+def get_user(
     user_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -126,7 +140,7 @@ async def get_user(
 
 
 @router.put("/{user_id}", response_model=schemas.UserResponse)
-async def update_user(
+def update_user(
     user_id: int,
     user_data: schemas.UserUpdate,
     db: Session = Depends(get_db),
@@ -141,10 +155,7 @@ async def update_user(
     for key, value in update_data.items():
         setattr(user, key, value)
     
-    db.commit()
-    db.refresh(user)
-    
-    # Log the update
+    # Log the update; committed together with it
     audit_log = models.AuditLog(
         action="user_updated",
         entity_type="user",
@@ -159,7 +170,7 @@ async def update_user(
 
 
 @router.delete("/{user_id}")
-async def delete_user(
+def delete_user(
     user_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_admin)
@@ -174,9 +185,8 @@ async def delete_user(
     
     email = user.email
     db.delete(user)
-    db.commit()
     
-    # Log the deletion
+    # Log the deletion; committed together with it
     audit_log = models.AuditLog(
         action="user_deleted",
         entity_type="user",
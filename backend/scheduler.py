@@ -2,10 +2,13 @@
 Scheduler - APScheduler setup for running AI agents periodically
 """
 import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from agents import PlanningAgent, RiskAgent, EscalationAgent, NotificationAgent
+from audit_writer import flush_audit_queue
 
 logger = logging.getLogger(__name__)
 
@@ -18,46 +21,79 @@ risk_agent = RiskAgent()
 escalation_agent = EscalationAgent()
 notification_agent = NotificationAgent()
 
+# Agents are I/O bound and each opens its own DB session, so independent agents
+# run side by side. The pool is kept small so it cannot exhaust DB connections.
+agent_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent")
+
+# A run that is late or still going is never doubled up: missed ticks collapse
+# into one run, and a tick more than a minute late is skipped
+JOB_DEFAULTS = {"coalesce": True, "max_instances": 1, "misfire_grace_time": 60}
+
+# Spread the agent tick so processes sharing the database don't open their
+# agent sessions on the same second
+AGENT_JITTER_SECONDS = 30
+
+# Agents in a phase run concurrently; later phases use the scores written by
+# earlier ones (escalation reads confidence_score from the risk agent)
+AGENT_PHASES = [
+    [planning_agent, risk_agent],
+    [escalation_agent, notification_agent]
+]
+
+# Minutes between runs of each agent; a single job ticks every minute and runs
+# the agents that are due, so the phase order holds for scheduled runs too
+AGENT_INTERVALS = {
+    planning_agent: 5,
+    risk_agent: 3,
+    escalation_agent: 10,
+    notification_agent: 2
+}
+
+# Minutes since the scheduler started, counted by the agent tick
+agent_ticks = itertools.count(1)
+
+
+def run_agents_in_phases(phases: list):
+    """Run the agents of each phase in parallel, one phase after another"""
+    for phase in phases:
+        futures = [agent_executor.submit(agent.run) for agent in phase]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            future.result()  # Re-raise the first agent error, if any
+
+
+def run_due_agents():
+    """Run the agents whose interval is up on this tick, in phases"""
+    tick = next(agent_ticks)
+    due_phases = [
+        [agent for agent in phase if tick % AGENT_INTERVALS[agent] == 0]
+        for phase in AGENT_PHASES
+    ]
+    run_agents_in_phases([phase for phase in due_phases if phase])
+
 
 def setup_scheduler():
     """Initialize and start the scheduler with all agent jobs"""
     global scheduler
     
-    scheduler = BackgroundScheduler()
+    scheduler = BackgroundScheduler(job_defaults=JOB_DEFAULTS)
     
-    # Planning Agent - runs every 5 minutes
+    # Agents - planning every 5 minutes, risk every 3, escalation every 10 and
+    # notification every 2, run in phases by one job ticking every minute
     scheduler.add_job(
-        planning_agent.run,
-        trigger=IntervalTrigger(minutes=5),
-        id="planning_agent",
-        name="Task Planning Agent",
+        run_due_agents,
+        trigger=IntervalTrigger(minutes=1, jitter=AGENT_JITTER_SECONDS),
+        id="agents",
+        name="AI Agents",
         replace_existing=True
     )
     
-    # Risk Agent - runs every 3 minutes
+    # Queued audit logs (e.g. logins) - written in batches twice a second
     scheduler.add_job(
-        risk_agent.run,
-        trigger=IntervalTrigger(minutes=3),
-        id="risk_agent",
-        name="Risk Assessment Agent",
-        replace_existing=True
-    )
-    
-    # Escalation Agent - runs every 10 minutes
-    scheduler.add_job(
-        escalation_agent.run,
-        trigger=IntervalTrigger(minutes=10),
-        id="escalation_agent",
-        name="Escalation Agent",
-        replace_existing=True
-    )
-    
-    # Notification Agent - runs every 2 minutes
-    scheduler.add_job(
-        notification_agent.run,
-        trigger=IntervalTrigger(minutes=2),
-        id="notification_agent",
-        name="Notification Agent",
+        flush_audit_queue,
+        trigger=IntervalTrigger(seconds=0.5),
+        id="audit_flush",
+        name="Audit Log Writer",
         replace_existing=True
     )
     
@@ -67,9 +103,10 @@ def setup_scheduler():
     
     # Run agents once at startup
     try:
-        planning_agent.run()
-        risk_agent.run()
-        notification_agent.run()
+        run_agents_in_phases([
+            [planning_agent, risk_agent],
+            [notification_agent]
+        ])
     except Exception as e:
         logger.error(f"Error running initial agent jobs: {str(e)}")
 
@@ -80,6 +117,8 @@ def shutdown_scheduler():
     
     if scheduler:
         scheduler.shutdown(wait=False)
+        agent_executor.shutdown(wait=False)
+        flush_audit_queue()  # Don't lose audit logs still waiting for the next flush
         logger.info("Scheduler shutdown complete")
 
 
@@ -103,7 +142,11 @@ def get_scheduler_status():
 
 
 def run_agent_manually(agent_name: str):
-    """Run a specific agent manually"""
+    """Run a specific agent manually ("all" runs every agent in phases)"""
+    if agent_name.lower() == "all":
+        run_agents_in_phases(AGENT_PHASES)
+        return True
+    
     agents = {
         "planning": planning_agent,
         "risk": risk_agent,
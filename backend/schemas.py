@@ -112,6 +112,7 @@ class NotificationResponse(NotificationBase):
     task_id: Optional[int] = None
     created_at: datetime
     sent_at: Optional[datetime] = None
+    read_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
@@ -141,6 +142,13 @@ class AuditLogResponse(BaseModel):
         from_attributes = True
 
 
+class AuditLogPage(BaseModel):
+    items: List[AuditLogResponse]
+    # Pass back as before_ts and before_id for the next page
+    next_cursor: Optional[datetime] = None
+    next_cursor_id: Optional[int] = None
+
+
 # ========== Agent Status Schemas ==========
 class AgentStatusResponse(BaseModel):
     id: int
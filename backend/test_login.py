@@ -1,51 +1,58 @@
-import urllib.request
-import urllib.error
+import http.client
 import json
 
-BASE_URL = "http://localhost:8000/api"
+HOST = "localhost"
+PORT = 8000
+BASE_PATH = "/api"
+
+# Encoded once, reused by every run
+LOGIN_BODY = json.dumps({
+    "email": "admin@erp.com",
+    "password": "admin123"
+}).encode('utf-8')
+JSON_HEADERS = {'Content-Type': 'application/json'}
 
 def test_login_flow():
     print("Testing Login Flow...")
     
-    # 1. Login
-    login_data = json.dumps({
-        "email": "admin@erp.com",
-        "password": "admin123"
-    }).encode('utf-8')
-    
-    req = urllib.request.Request(
-        f"{BASE_URL}/users/login",
-        data=login_data,
-        headers={'Content-Type': 'application/json'}
-    )
+    # Both requests ride one keep-alive connection
+    conn = http.client.HTTPConnection(HOST, PORT)
     
     try:
-        with urllib.request.urlopen(req) as response:
-            print("LOGIN SUCCESS")
-            data = json.loads(response.read().decode('utf-8'))
-            token = data.get("access_token")
-            print(f"Token received: {token[:20]}...")
-            
-            # 2. Use Token
-            user_req = urllib.request.Request(
-                f"{BASE_URL}/users/me",
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            
-            try:
-                with urllib.request.urlopen(user_req) as user_response:
-                    print("TOKEN VALIDATION SUCCESS")
-                    user_data = json.loads(user_response.read().decode('utf-8'))
-                    print(f"User: {user_data.get('email')}")
-            except urllib.error.HTTPError as e:
-                print(f"TOKEN VALIDATION FAILED: {e.code}")
-                print(e.read().decode('utf-8'))
-                
-    except urllib.error.HTTPError as e:
-        print(f"LOGIN FAILED: {e.code}")
-        print(e.read().decode('utf-8'))
+        # 1. Login
+        conn.request("POST", f"{BASE_PATH}/users/login", body=LOGIN_BODY, headers=JSON_HEADERS)
+        response = conn.getresponse()
+        body = response.read().decode('utf-8')  # Read fully before reusing the connection
+        if response.status >= 400:
+            print(f"LOGIN FAILED: {response.status}")
+            print(body)
+            return
+        
+        print("LOGIN SUCCESS")
+        data = json.loads(body)
+        token = data.get("access_token")
+        print(f"Token received: {token[:20]}...")
+        
+        # 2. Use Token
+        conn.request(
+            "GET",
+            f"{BASE_PATH}/users/me",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        user_response = conn.getresponse()
+        user_body = user_response.read().decode('utf-8')
+        if user_response.status >= 400:
+            print(f"TOKEN VALIDATION FAILED: {user_response.status}")
+            print(user_body)
+            return
+        
+        print("TOKEN VALIDATION SUCCESS")
+        user_data = json.loads(user_body)
+        print(f"User: {user_data.get('email')}")
     except Exception as e:
         print(f"ERROR: {str(e)}")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     test_login_flow()
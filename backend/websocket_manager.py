@@ -1,36 +1,211 @@
 from fastapi import WebSocket
-from typing import List
-import json
+from typing import Dict, Optional, Set
 import asyncio
+import logging
+import orjson
+
+logger = logging.getLogger(__name__)
+
+class Client:
+    """A connected socket with its own queue of outgoing frames and the task sending them"""
+    
+    __slots__ = ("websocket", "queue", "task", "topics")
+    
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.topics: Set[str] = set()  # Rooms this client is in, for cleanup on disconnect
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    __slots__ = (
+        "active_connections", "rooms", "send_timeout", "client_queue_size",
+        "outbox", "_loop", "coalesce_window", "max_batch", "_drain_task"
+    )
+    
+    def __init__(
+        self,
+        outbox_size: int = 10_000,
+        send_timeout: float = 5.0,
+        client_queue_size: int = 64,
+        coalesce_window: float = 0.02,
+        max_batch: int = 500
+    ):
+        self.active_connections: Dict[WebSocket, Client] = {}
+        # Subscribers per topic; a topic is removed when its last subscriber leaves
+        self.rooms: Dict[str, Set[Client]] = {}
+        # A client that can't take a frame within send_timeout seconds, or falls
+        # client_queue_size frames behind, is dropped; it only ever slows itself
+        self.send_timeout = send_timeout
+        self.client_queue_size = client_queue_size
+        # Messages from synchronous code (DB event listeners, agent threads) wait here
+        # until the drain task sends them, so writers never block on client sends.
+        # Only touched on the event loop; other threads hand messages over through _loop
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=outbox_size)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Messages queued within coalesce_window seconds of each other go out as one BATCH frame
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self._drain_task: Optional[asyncio.Task] = None
     
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = Client(websocket, self.client_queue_size)
+        client.task = asyncio.create_task(self.write_frames(client))
+        self.active_connections[websocket] = client
+    
+    def subscribe(self, websocket: WebSocket, topic: str):
+        """Have a client receive the messages published to topic"""
+        client = self.active_connections.get(websocket)
+        if client is not None:
+            self.rooms.setdefault(topic, set()).add(client)
+            client.topics.add(topic)
+    
+    def has_subscribers(self, topic: str) -> bool:
+        """Whether any client subscribes to topic (a lock-free read, safe from any thread)"""
+        return topic in self.rooms
+    
+    def forget(self, websocket: WebSocket) -> Optional[Client]:
+        """Remove a client from the connections and from every room it joined"""
+        client = self.active_connections.pop(websocket, None)
+        if client is not None:
+            for topic in client.topics:
+                room = self.rooms.get(topic)
+                if room is not None:
+                    room.discard(client)
+                    if not room:
+                        del self.rooms[topic]
+        return client
     
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        """Forget a client that went away, stopping its writer"""
+        client = self.forget(websocket)
+        if client is not None:
+            client.task.cancel()
     
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
-
-    def broadcast_sync(self, message: dict):
-        """Helper to broadcast from synchronous context (like SQLAlchemy events)"""
+        """Send a message to every connected client"""
+        self.push_all(tuple(self.active_connections.values()), message)
+    
+    async def publish(self, topic: str, message: dict):
+        """Send a message to the clients subscribed to topic"""
+        self.push_all(tuple(self.rooms.get(topic, ())), message)
+    
+    def push_all(self, clients: tuple, message: dict):
+        """Encode a message once and queue it for each client (a snapshot; clients may leave mid-loop)"""
+        if not clients:
+            return
+        
+        # Serialize once for all clients; sent as text since clients JSON.parse the frame
+        # (browsers hand binary frames over as Blobs). orjson writes datetimes in
+        # ISO 8601 (like isoformat()) and enums by value
+        payload = orjson.dumps(message).decode()
+        
+        # Only enqueues; each client's writer task does the sending
+        for client in clients:
+            self.push(client, payload)
+    
+    def send(self, websocket: WebSocket, message: dict):
+        """Send a message to one client, after anything already queued for it"""
+        client = self.active_connections.get(websocket)
+        if client is not None:
+            self.push(client, orjson.dumps(message).decode())
+    
+    def push(self, client: Client, payload: str):
+        """Queue an encoded frame for a client, dropping the client if it has fallen too far behind"""
+        try:
+            client.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.drop(client)
+    
+    def drop(self, client: Client):
+        """Stop sending to a client that fell too far behind; its writer closes the socket"""
+        self.forget(client.websocket)
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        client.queue.put_nowait(None)
+    
+    async def write_frames(self, client: Client):
+        """Send a client's queued frames in order until it is dropped or a send fails or times out"""
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                loop.create_task(self.broadcast(message))
-            else:
-                asyncio.run(self.broadcast(message))
+            while True:
+                payload = await client.queue.get()
+                if payload is None:
+                    break
+                await asyncio.wait_for(client.websocket.send_text(payload), self.send_timeout)
         except Exception as e:
-            print(f"Broadcast sync error: {e}")
+            logger.info(f"Dropping WebSocket client after failed send: {e!r}")
+        
+        # Closing ends the endpoint's receive loop (best effort, the socket may be gone already)
+        self.forget(client.websocket)
+        try:
+            await asyncio.wait_for(client.websocket.close(), self.send_timeout)
+        except Exception:
+            pass
+
+    def publish_after_commit(self, session, topic: str, message: dict):
+        """Hold a message until the DB session commits (discarded on rollback)"""
+        session.info.setdefault("ws_outbox", []).append((topic, message))
+    
+    def publish_sync(self, topic: str, message: dict):
+        """Helper to publish from synchronous context (like SQLAlchemy events), from any thread"""
+        loop = self._loop
+        if loop is None or not self.has_subscribers(topic):
+            return
+        try:
+            loop.call_soon_threadsafe(self.enqueue, topic, message)
+        except RuntimeError:
+            pass  # Loop closed during shutdown
+    
+    def enqueue(self, topic: str, message: dict):
+        """Queue a message for the drain task (runs on the event loop)"""
+        try:
+            self.outbox.put_nowait((topic, message))
+        except asyncio.QueueFull:
+            logger.warning(f"WebSocket outbox full, dropping {message.get('type')} message")
+    
+    async def drain_outbox(self):
+        """Send queued messages to subscribers until the stop sentinel arrives"""
+        while True:
+            item = await self.outbox.get()
+            if item is None:
+                break
+            
+            # Let the rest of the commit (or burst of commits) arrive, then send it all at once
+            await asyncio.sleep(self.coalesce_window)
+            items = [item]
+            while len(items) < self.max_batch and not self.outbox.empty():
+                item = self.outbox.get_nowait()
+                if item is None:
+                    return
+                items.append(item)
+            
+            # One frame per topic, each keeping its messages in the order they were queued
+            by_topic: Dict[str, list] = {}
+            for topic, message in items:
+                by_topic.setdefault(topic, []).append(message)
+            for topic, messages in by_topic.items():
+                # One bad message (e.g. a value orjson can't encode) must not stop the drain task
+                try:
+                    await self.publish(topic, messages[0] if len(messages) == 1 else {"type": "BATCH", "data": messages})
+                except Exception:
+                    logger.exception(f"Failed to publish {len(messages)} WebSocket messages to {topic}")
+    
+    def start(self):
+        """Start the outbox drain task on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._drain_task = asyncio.create_task(self.drain_outbox())
+    
+    async def stop(self):
+        """Stop the drain task, discarding unsent messages"""
+        if self._drain_task is None:
+            return
+        self._loop = None
+        while not self.outbox.empty():
+            self.outbox.get_nowait()
+        self.outbox.put_nowait(None)
+        await self._drain_task
+        self._drain_task = None
 
 manager = ConnectionManager()
@@ -3,6 +3,7 @@
  */
 
 const API_BASE = 'http://localhost:8000/api';
+const WS_URL = 'ws://localhost:8000/ws';
 
 class ApiClient {
     constructor() {
@@ -146,11 +147,11 @@ class ApiClient {
     }
 
     async getHighRiskTasks() {
-        return this.request('/tasks/high-risk');
+        return this.request('/tasks/high-risk?expand_fields=assignee');
     }
 
     async getOverdueTasks() {
-        return this.request('/tasks/overdue');
+        return this.request('/tasks/overdue?expand_fields=assignee');
     }
 
     // Notifications endpoints
@@ -209,5 +210,22 @@ class ApiClient {
     }
 }
 
+// Open a WebSocket that receives the given topics ('tasks', 'audit', 'notifications'),
+// scoped like the REST API to the signed-in user: 'audit' needs a manager or admin,
+// and users only get the tasks assigned to them and their own notifications
+export function openSocket(topics) {
+    const socket = new WebSocket(WS_URL);
+    socket.onopen = () => {
+        socket.send(JSON.stringify({ type: 'subscribe', topics, token: api.getToken() }));
+    };
+    return socket;
+}
+
+// A WebSocket frame carries one message, or several sent together as a BATCH
+export function parseSocketMessages(event) {
+    const message = JSON.parse(event.data);
+    return message.type === 'BATCH' ? message.data : [message];
+}
+
 export const api = new ApiClient();
 export default api;
@@ -1,7 +1,7 @@
 import { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import { api } from '../api/client';
+import { api, openSocket, parseSocketMessages } from '../api/client';
 import './Header.css';
 
 export default function Header() {
@@ -19,10 +19,50 @@ export default function Header() {
         };
 
         fetchUnreadCount();
-        const interval = setInterval(fetchUnreadCount, 30000); // Poll every 30 seconds
+        // Changes are pushed over the WebSocket; this slow poll only covers a dropped connection
+        const interval = setInterval(fetchUnreadCount, 300000);
 
-        return () => clearInterval(interval);
-    }, []);
+        // Reads and deletes arrive one message per notification; refetch once per burst
+        let refetchTimer = null;
+        const scheduleRefetch = () => {
+            if (!refetchTimer) {
+                refetchTimer = setTimeout(() => {
+                    refetchTimer = null;
+                    fetchUnreadCount();
+                }, 500);
+            }
+        };
+
+        const socket = openSocket(['notifications']);
+
+        socket.onmessage = (event) => {
+            for (const message of parseSocketMessages(event)) {
+                if (message.type === 'NOTIFICATION_UPDATE') {
+                    const notification = message.data;
+                    if (!notification.changes) {
+                        // New notifications carry the full row; only our own unread ones count
+                        if (notification.user_id === user?.id && !notification.is_read) {
+                            setUnreadCount(count => count + 1);
+                        }
+                    } else if ('is_read' in notification.changes) {
+                        scheduleRefetch();
+                    }
+                } else if (message.type === 'NOTIFICATION_DELETE') {
+                    scheduleRefetch();
+                }
+            }
+        };
+
+        socket.onerror = (error) => {
+            console.error('Header WebSocket error:', error);
+        };
+
+        return () => {
+            clearInterval(interval);
+            clearTimeout(refetchTimer);
+            socket.close();
+        };
+    }, [user?.id]);
 
     return (
         <header className="header">
@@ -1,10 +1,11 @@
 import { useState, useEffect } from 'react';
-import { api } from '../api/client';
+import { api, openSocket, parseSocketMessages } from '../api/client';
 import './AuditLogs.css';
 
 export default function AuditLogs() {
     const [logs, setLogs] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [cursor, setCursor] = useState(null);  // Where the next, older page starts
     const [filter, setFilter] = useState({ action: '', entity_type: '', days: 7 });
 
     useEffect(() => {
@@ -12,17 +13,21 @@ export default function AuditLogs() {
     }, [filter]);
 
     useEffect(() => {
-        const socket = new WebSocket('ws://localhost:8000/ws');
+        const socket = openSocket(['audit']);
 
         socket.onmessage = (event) => {
-            const message = JSON.parse(event.data);
-            if (message.type === 'AUDIT_LOG') {
-                const newLog = message.data;
-
-                // Only add if it matches current entity_type filter
-                if (!filter.entity_type || newLog.entity_type === filter.entity_type) {
-                    setLogs(prevLogs => [newLog, ...prevLogs.slice(0, 99)]);
-                }
+            // Messages and agents' AUDIT_LOG_BATCH logs arrive oldest first; the list shows newest first
+            const newLogs = parseSocketMessages(event).flatMap(message =>
+                message.type === 'AUDIT_LOG' ? [message.data]
+                : message.type === 'AUDIT_LOG_BATCH' ? message.data
+                : []
+            ).reverse();
+
+            // Only add if it matches current entity_type filter
+            const matching = newLogs.filter(log => !filter.entity_type || log.entity_type === filter.entity_type);
+            if (matching.length) {
+                // Not trimmed: older pages may be loaded below, and the cursor points past them
+                setLogs(prevLogs => [...matching, ...prevLogs]);
             }
         };
 
@@ -38,7 +43,8 @@ export default function AuditLogs() {
     const fetchLogs = async () => {
         try {
             const data = await api.getAuditLogs(filter);
-            setLogs(data);
+            setLogs(data.items);
+            setCursor(pageCursor(data));
         } catch (error) {
             console.error('Error fetching audit logs:', error);
         } finally {
@@ -46,6 +52,21 @@ export default function AuditLogs() {
         }
     };
 
+    const loadOlderLogs = async () => {
+        try {
+            const data = await api.getAuditLogs({ ...filter, ...cursor });
+            setLogs(prevLogs => [...prevLogs, ...data.items]);
+            setCursor(pageCursor(data));
+        } catch (error) {
+            console.error('Error fetching audit logs:', error);
+        }
+    };
+
+    // Logs written together share a timestamp, so the cursor carries the last id too
+    const pageCursor = (data) => data.next_cursor
+        ? { before_ts: data.next_cursor, before_id: data.next_cursor_id }
+        : null;
+
     const formatTime = (dateString) => {
         return new Date(dateString).toLocaleString('en-US', {
             month: 'short',
@@ -140,6 +161,14 @@ export default function AuditLogs() {
                         ))}
                     </div>
                 )}
+
+                {cursor && (
+                    <div className="load-more">
+                        <button className="btn btn-secondary" onClick={loadOlderLogs}>
+                            Load older entries
+                        </button>
+                    </div>
+                )}
             </div>
         </div>
     );
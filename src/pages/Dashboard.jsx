@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
-import { api } from '../api/client';
+import { api, openSocket, parseSocketMessages } from '../api/client';
 import './Dashboard.css';
 
 export default function Dashboard() {
@@ -14,11 +14,11 @@ export default function Dashboard() {
     }, []);
 
     useEffect(() => {
-        const socket = new WebSocket('ws://localhost:8000/ws');
+        const socket = openSocket(['tasks', 'notifications']);
 
         socket.onmessage = (event) => {
-            const message = JSON.parse(event.data);
-            if (message.type === 'TASK_UPDATE' || message.type === 'TASK_DELETE' || message.type === 'NOTIFICATION_UPDATE') {
+            const messages = parseSocketMessages(event);
+            if (messages.some(message => message.type === 'TASK_UPDATE' || message.type === 'TASK_DELETE' || message.type === 'NOTIFICATION_UPDATE')) {
                 // For simplicity, refetch all dashboard data when any relevant change occurs
                 // This ensures stats and task lists are always in sync
                 fetchDashboardData();
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { api } from '../api/client';
+import { api, openSocket, parseSocketMessages } from '../api/client';
 import './Notifications.css';
 
 export default function Notifications() {
@@ -12,25 +12,23 @@ export default function Notifications() {
     }, []);
 
     useEffect(() => {
-        const socket = new WebSocket('ws://localhost:8000/ws');
+        const socket = openSocket(['notifications']);
 
         socket.onmessage = (event) => {
-            const message = JSON.parse(event.data);
-            if (message.type === 'NOTIFICATION_UPDATE') {
-                const updatedNotif = message.data;
-                setNotifications(prev => {
-                    // Check if notification is for us or broadcast
-                    // Simple logic: if it exists, update it; if not, add it
-                    const exists = prev.find(n => n.id === updatedNotif.id);
-                    if (exists) {
-                        return prev.map(n => n.id === updatedNotif.id ? updatedNotif : n);
-                    } else {
+            for (const message of parseSocketMessages(event)) {
+                if (message.type === 'NOTIFICATION_UPDATE') {
+                    const updatedNotif = message.data;
+                    setNotifications(prev => {
+                        // Updates carry only the changed fields; new notifications carry the full row
+                        if (updatedNotif.changes) {
+                            return prev.map(n => n.id === updatedNotif.id ? { ...n, ...updatedNotif.changes } : n);
+                        }
                         return [updatedNotif, ...prev.slice(0, 49)];
-                    }
-                });
-            } else if (message.type === 'NOTIFICATION_DELETE') {
-                const deletedId = message.data.id;
-                setNotifications(prev => prev.filter(n => n.id !== deletedId));
+                    });
+                } else if (message.type === 'NOTIFICATION_DELETE') {
+                    const deletedId = message.data.id;
+                    setNotifications(prev => prev.filter(n => n.id !== deletedId));
+                }
             }
         };
 